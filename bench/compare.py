@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+对比两次压测结果，超过阈值的退化标记出来，存在退化时退出码为 1
+
+用法：
+    python -m bench.compare bench/results/base.json bench/results/new.json --threshold 10
+"""
+
+import argparse
+import json
+import sys
+
+# 数值越大越好的指标，其余数值指标都是越小越好
+HIGHER_IS_BETTER = {"monitors_started", "xhr_per_second", "deliveries", "deliveries_per_second", "rotations_issued", "rotations_delivered"}
+# 只展示、不判断退化的指标
+INFORMATIONAL = {"sample_seconds"}
+
+
+def compare(base: dict, new: dict, threshold: float) -> list:
+    """返回 [(指标, 基线, 新值, 变化百分比, 是否退化)]。"""
+    rows = []
+    for key, base_value in base["results"].items():
+        new_value = new["results"].get(key)
+        if not isinstance(base_value, (int, float)) or not isinstance(new_value, (int, float)):
+            rows.append((key, base_value, new_value, None, False))
+            continue
+        change = (new_value - base_value) / abs(base_value) * 100 if base_value else None
+        worse = change is not None and key not in INFORMATIONAL and (
+            change < -threshold if key in HIGHER_IS_BETTER else change > threshold
+        )
+        rows.append((key, base_value, new_value, change, worse))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="对比两次压测结果")
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=10, help="变化超过该百分比视为退化")
+    args = parser.parse_args(argv)
+
+    with open(args.base, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)
+    if base.get("params", {}).get("monitors") != new.get("params", {}).get("monitors"):
+        print("[提示] 两次压测的监控数量不同，结果不可直接比较")
+
+    rows = compare(base, new, args.threshold)
+    print(f"{'指标':28} {base.get('git_rev') or 'base':>12} {new.get('git_rev') or 'new':>12} {'变化':>9}")
+    for key, base_value, new_value, change, worse in rows:
+        change_text = f"{change:+.1f}%" if change is not None else "-"
+        print(f"{key:30} {str(base_value):>12} {str(new_value):>12} {change_text:>9}{'  <-- 退化' if worse else ''}")
+    sys.exit(1 if any(row[4] for row in rows) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+"""
+离线压测：启动媒体后台和 cookie_api 替身，用临时 sites.json 启动监控服务，
+通过接口批量启动 N 个监控，运行一段时间后统计端到端延迟、投递速率、事件循环延迟、RSS 和 CPU，
+结果保存为 JSON，可用 bench/compare.py 对比两次结果
+
+用法（在项目根目录）：
+    python -m bench.run --monitors 20 --duration 60 --label baseline
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uvicorn
+import requests
+from bench.stubs import create_dashboard_app, create_cookie_api_app
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "bench", "results")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="监控服务离线压测")
+    parser.add_argument("--monitors", type=int, default=10, help="监控数量（每个监控一个独立用户）")
+    parser.add_argument("--duration", type=float, default=60, help="监控全部启动后的采样时长（秒）")
+    parser.add_argument("--burst", type=int, default=5, help="页面每批发起的 XHR 数")
+    parser.add_argument("--interval-ms", type=int, default=1000, help="页面两批 XHR 的间隔（毫秒）")
+    parser.add_argument("--rotate", type=float, default=5, help="cookie 轮换周期（秒）")
+    parser.add_argument("--app-port", type=int, default=18000)
+    parser.add_argument("--dashboard-port", type=int, default=18101)
+    parser.add_argument("--cookie-api-port", type=int, default=18102)
+    parser.add_argument("--config", action="append", default=[], metavar="KEY=JSON",
+                        help="覆盖 config 中的配置项，如 --config request_filter_mode='\"route\"'，可重复")
+    parser.add_argument("--label", default="run", help="结果文件名中的标签")
+    parser.add_argument("--output", help="结果文件路径，默认 bench/results/<时间>-<label>.json")
+    return parser.parse_args(argv)
+
+
+def build_sites(args, workdir: str) -> dict:
+    config = {
+        "cookie_api": f"http://127.0.0.1:{args.cookie_api_port}/api/refreshCookie",
+        "headless_mode": True,
+        "performance_mode": False,
+        "user_data_dir": os.path.join(workdir, "user_data"),
+        "restore_monitors": False,
+        "log_level": "WARNING",
+        "account_types": {"1": {"name": "bench"}},
+        # 使用 localhost 访问，cookie 按主机名匹配，domains 写 localhost 即可通过域名筛选
+        "media_codes": {"1": {"name": "bench", "url": f"http://localhost:{args.dashboard_port}/", "domains": ["localhost"]}},
+    }
+    for item in args.config:
+        key, _, value = item.partition("=")
+        config[key] = json.loads(value)
+    users = [
+        {"user_id": user_id, "sites": [{"code": 1, "account_type": 1, "account": f"bench{user_id}", "password": "",
+                                        "contact": "bench", "description": "bench"}]}
+        for user_id in range(1, args.monitors + 1)
+    ]
+    return {"users": users, "config": config}
+
+
+async def serve(app, port: int):
+    """在当前事件循环中启动替身服务，返回 (server, task)，由 shutdown 停止。"""
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off"))
+    task = asyncio.create_task(server.serve(), name=f"bench-stub:{port}")
+    while not server.started:
+        if task.done():
+            task.result()  # 启动失败（如端口被占用）时抛出异常
+        await asyncio.sleep(0.05)
+    return server, task
+
+
+async def shutdown(servers, timeout: float = 10):
+    """通知替身服务退出并等待其任务结束，超时后取消。"""
+    for server, _ in servers:
+        server.should_exit = True
+    tasks = [task for _, task in servers]
+    done, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def start_app(args, sites_path: str) -> subprocess.Popen:
+    env = dict(os.environ, MONITOR_SITES_FILE=sites_path)
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server.app:app", "--host", "127.0.0.1", "--port", str(args.app_port),
+         "--log-level", "warning"],
+        cwd=ROOT, env=env,
+    )
+
+
+async def wait_ready(base: str, process: subprocess.Popen, path: str = "/api/config", timeout: float = 120) -> dict:
+    """轮询 path 直到返回 200，返回响应 JSON；/api/ready 报告浏览器启动失败时直接报错。"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"监控服务启动失败，退出码 {process.returncode}")
+        try:
+            response = await asyncio.to_thread(requests.get, f"{base}{path}", timeout=2)
+            if response.ok:
+                return response.json()
+            if path == "/api/ready" and response.json().get("browser") == "failed":
+                raise RuntimeError(f"浏览器启动失败: {response.json().get('error')}")
+        except requests.RequestException:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError(f"等待 {path} 就绪超时")
+
+
+def parse_histogram(text: str, name: str) -> dict:
+    """从 /metrics 文本中取出无标签直方图的 {le: 累计数}、sum、count。"""
+    buckets, total, count = {}, 0.0, 0
+    for line in text.splitlines():
+        if line.startswith(f"{name}_bucket"):
+            le = line.split('le="', 1)[1].split('"', 1)[0]
+            buckets[float("inf") if le == "+Inf" else float(le)] = float(line.rsplit(" ", 1)[1])
+        elif line.startswith(f"{name}_sum"):
+            total = float(line.rsplit(" ", 1)[1])
+        elif line.startswith(f"{name}_count"):
+            count = int(float(line.rsplit(" ", 1)[1]))
+    return {"buckets": buckets, "sum": total, "count": count}
+
+
+def histogram_quantile(hist: dict, q: float):
+    """按桶上界估算分位数（保守取上界）。"""
+    if not hist["count"]:
+        return None
+    rank = q * hist["count"]
+    for bound in sorted(hist["buckets"]):
+        if hist["buckets"][bound] >= rank:
+            return bound
+    return None
+
+
+class ResourceSampler:
+    """累计监控服务进程及其子进程（浏览器）的 CPU 时间，记录 RSS 峰值和平均值。"""
+
+    def __init__(self, pid: int):
+        self.process = psutil.Process(pid) if psutil else None
+        self.rss = []
+        self._cpu_start = None
+        self._wall_start = None
+
+    def _processes(self):
+        procs = [self.process]
+        try:
+            procs += self.process.children(recursive=True)
+        except psutil.Error:
+            pass
+        return procs
+
+    def _cpu_seconds(self) -> float:
+        total = 0.0
+        for proc in self._processes():
+            try:
+                times = proc.cpu_times()
+                total += times.user + times.system
+            except psutil.Error:
+                pass
+        return total
+
+    def start(self):
+        if self.process:
+            self._cpu_start = self._cpu_seconds()
+            self._wall_start = time.monotonic()
+
+    def sample(self):
+        if not self.process:
+            return
+        total = 0
+        for proc in self._processes():
+            try:
+                total += proc.memory_info().rss
+            except psutil.Error:
+                pass
+        self.rss.append(total)
+
+    def result(self) -> dict:
+        if not self.process or self._cpu_start is None:
+            return {"rss_mb_mean": None, "rss_mb_max": None, "cpu_percent": None}
+        cpu = (self._cpu_seconds() - self._cpu_start) / max(time.monotonic() - self._wall_start, 1e-9) * 100
+        return {
+            "rss_mb_mean": round(statistics.mean(self.rss) / 1048576, 1) if self.rss else None,
+            "rss_mb_max": round(max(self.rss) / 1048576, 1) if self.rss else None,
+            "cpu_percent": round(cpu, 1),
+        }
+
+
+def percentile(values: list, q: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * len(values)))], 1)
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+async def run(args) -> dict:
+    dashboard = create_dashboard_app(args.burst, args.interval_ms, args.rotate)
+    cookie_api = create_cookie_api_app()
+    servers = [await serve(dashboard, args.dashboard_port), await serve(cookie_api, args.cookie_api_port)]
+    recorder = cookie_api.state.recorder
+    base = f"http://127.0.0.1:{args.app_port}"
+
+    try:
+        with tempfile.TemporaryDirectory(prefix="monitor-bench-") as workdir:
+            sites_path = os.path.join(workdir, "sites.json")
+            with open(sites_path, "w", encoding="utf-8") as f:
+                json.dump(build_sites(args, workdir), f, ensure_ascii=False)
+            process = start_app(args, sites_path)
+            try:
+                launch_started = time.monotonic()
+                await wait_ready(base, process)
+                ready_seconds = time.monotonic() - launch_started
+                await wait_ready(base, process, "/api/ready")
+                browser_ready_seconds = time.monotonic() - launch_started
+
+                # 批量启动全部监控
+                items = [{"user_id": user_id, "site_code": 1} for user_id in range(1, args.monitors + 1)]
+                started = time.monotonic()
+                response = await asyncio.to_thread(
+                    requests.post, f"{base}/api/monitor/bulk/start", json={"items": items}, timeout=600
+                )
+                start_seconds = time.monotonic() - started
+                started_ok = response.json().get("succeeded", 0) if response.ok else 0
+
+                # 只统计采样期内的投递
+                sampler = ResourceSampler(process.pid)
+                sampler.start()
+                first_delivery = len(recorder.deliveries)
+                first_requests = dashboard.state.stats.requests
+                metrics_before = (await asyncio.to_thread(requests.get, f"{base}/metrics", timeout=10)).text
+                sample_started = time.monotonic()
+                sample_started_ns = time.time_ns()
+                while time.monotonic() - sample_started < args.duration:
+                    await asyncio.sleep(1)
+                    sampler.sample()
+                elapsed = time.monotonic() - sample_started
+                sample_ended_ns = time.time_ns()
+                # 多等一个请求间隔，让采样期末签发的 cookie 也有机会被投递
+                await asyncio.sleep(args.interval_ms / 1000 + 1)
+                metrics_after = (await asyncio.to_thread(requests.get, f"{base}/metrics", timeout=10)).text
+
+                startup = (await asyncio.to_thread(requests.get, f"{base}/api/ready", timeout=10)).json()
+                await asyncio.to_thread(requests.post, f"{base}/api/monitor/bulk/stop", json={"items": items}, timeout=600)
+            finally:
+                process.terminate()
+                try:
+                    process.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+    finally:
+        await shutdown(servers)
+
+    deliveries = recorder.deliveries[first_delivery:]
+    latencies = recorder.latencies_ms(first_delivery)
+    # 只统计采样期内签发的 cookie 有多少被投递
+    issued = {key for key, issued_ns in dashboard.state.stats.issued.items() if sample_started_ns <= issued_ns <= sample_ended_ns}
+    delivered = recorder.delivered_versions(first_delivery)
+
+    lag_before = parse_histogram(metrics_before, "event_loop_lag_seconds")
+    lag_after = parse_histogram(metrics_after, "event_loop_lag_seconds")
+    lag = {
+        "buckets": {le: lag_after["buckets"].get(le, 0) - lag_before["buckets"].get(le, 0) for le in lag_after["buckets"]},
+        "sum": lag_after["sum"] - lag_before["sum"],
+        "count": lag_after["count"] - lag_before["count"],
+    }
+    resources = sampler.result()
+    per_monitor = lambda value: round(value / args.monitors, 2) if value is not None and args.monitors else None
+    p99_lag = histogram_quantile(lag, 0.99)
+
+    return {
+        "label": args.label,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_rev": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("output",)},
+        "results": {
+            "monitors_started": started_ok,
+            "app_ready_seconds": round(ready_seconds, 2),
+            "browser_ready_seconds": round(browser_ready_seconds, 2),
+            "server_time_to_browser_ready": startup.get("time_to_browser_ready"),
+            "server_time_to_first_monitor": startup.get("time_to_first_monitor"),
+            "bulk_start_seconds": round(start_seconds, 2),
+            "sample_seconds": round(elapsed, 1),
+            "xhr_per_second": round((dashboard.state.stats.requests - first_requests) / elapsed, 1),
+            "deliveries": len(deliveries),
+            "deliveries_per_second": round(len(deliveries) / elapsed, 2),
+            "rotations_issued": len(issued),
+            "rotations_delivered": len(delivered & issued),
+            "latency_ms_p50": percentile(latencies, 0.5),
+            "latency_ms_p95": percentile(latencies, 0.95),
+            "latency_ms_p99": percentile(latencies, 0.99),
+            "latency_ms_max": round(max(latencies), 1) if latencies else None,
+            "loop_lag_ms_mean": round(lag["sum"] / lag["count"] * 1000, 2) if lag["count"] else None,
+            "loop_lag_ms_p99": round(p99_lag * 1000, 1) if p99_lag not in (None, float("inf")) else None,
+            "rss_mb_mean": resources["rss_mb_mean"],
+            "rss_mb_max": resources["rss_mb_max"],
+            "rss_mb_per_monitor": per_monitor(resources["rss_mb_mean"]),
+            "cpu_percent": resources["cpu_percent"],
+            "cpu_percent_per_monitor": per_monitor(resources["cpu_percent"]),
+        },
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if psutil is None:
+        print("[提示] 未安装 psutil，不统计 RSS 和 CPU（pip install psutil）")
+    result = asyncio.run(run(args))
+    output = args.output or os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{args.label}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    for key, value in result["results"].items():
+        print(f"{key:28} {value}")
+    print(f"结果已保存: {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+压测用的本地替身服务：
+- 媒体后台：页面按固定间隔成批发起 XHR，服务端按 rotate 周期轮换 cookie，cookie 值中带签发时间
+- cookie_api：记录收到的每次投递，用签发时间计算端到端延迟
+"""
+
+import itertools
+import time
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, JSONResponse
+
+SESSION_COOKIE = "bench_session"
+CLIENT_COOKIE = "bench_client"
+
+DASHBOARD_HTML = """<!doctype html>
+<html><head><meta charset="utf-8"><title>bench dashboard</title></head>
+<body>
+<div id="count">0</div>
+<script>
+let count = 0;
+function burst() {
+  for (let i = 0; i < %(burst)d; i++) {
+    fetch('/api/data?i=' + (count++), { credentials: 'include' }).then(r => r.text());
+  }
+  document.getElementById('count').textContent = count;
+}
+setInterval(burst, %(interval_ms)d);
+burst();
+</script>
+</body></html>
+"""
+
+
+class DashboardStats:
+    def __init__(self):
+        self.requests = 0
+        self.issued = {}  # (client, version) -> 签发时间 time.time_ns()
+
+
+def create_dashboard_app(burst: int = 5, interval_ms: int = 1000, rotate: float = 5, payload_bytes: int = 256):
+    """
+    媒体后台替身。每个浏览器 context 首次访问时分配 client id，
+    之后每个 rotate 周期内第一次请求时下发新的 bench_session=v{版本}_{签发ns}_{client}。
+    """
+    app = FastAPI()
+    stats = DashboardStats()
+    app.state.stats = stats
+    client_ids = itertools.count(1)
+    started = time.monotonic()
+    body = "x" * payload_bytes
+
+    def attach_cookies(request: Request, response):
+        client = request.cookies.get(CLIENT_COOKIE)
+        if not client:
+            client = str(next(client_ids))
+            response.set_cookie(CLIENT_COOKIE, client, path="/")
+        version = int((time.monotonic() - started) // rotate)
+        current = request.cookies.get(SESSION_COOKIE, "")
+        if not current.startswith(f"v{version}_"):
+            issued_ns = time.time_ns()
+            stats.issued[(client, version)] = issued_ns
+            response.set_cookie(SESSION_COOKIE, f"v{version}_{issued_ns}_{client}", path="/")
+        return response
+
+    @app.get("/")
+    def index(request: Request):
+        html = DASHBOARD_HTML % {"burst": burst, "interval_ms": interval_ms}
+        return attach_cookies(request, HTMLResponse(html))
+
+    @app.get("/api/data")
+    def data(request: Request):
+        stats.requests += 1
+        return attach_cookies(request, JSONResponse({"data": body}))
+
+    return app
+
+
+class CookieApiRecorder:
+    def __init__(self):
+        self.deliveries = []  # [(收到时间ns, payload)]
+
+    def record(self, payload):
+        received_ns = time.time_ns()
+        for item in payload if isinstance(payload, list) else [payload]:
+            self.deliveries.append((received_ns, item))
+
+    def latencies_ms(self, since: int = 0) -> list:
+        """从 cookies 中的 bench_session 解析签发时间，返回第 since 条之后每次投递的延迟（毫秒）。"""
+        result = []
+        for received_ns, item in self.deliveries[since:]:
+            session = parse_session(item.get("cookies", ""))
+            if session:
+                result.append((received_ns - session[1]) / 1e6)
+        return result
+
+    def delivered_versions(self, since: int = 0) -> set:
+        """第 since 条之后收到过的 (client, version)。"""
+        result = set()
+        for _, item in self.deliveries[since:]:
+            session = parse_session(item.get("cookies", ""))
+            if session:
+                result.add((session[2], session[0]))
+        return result
+
+
+def parse_session(cookie_header: str):
+    """返回 (version, 签发ns, client)，没有 bench_session 时返回 None。"""
+    for part in cookie_header.split(";"):
+        name, _, value = part.strip().partition("=")
+        if name == SESSION_COOKIE:
+            try:
+                version, issued_ns, client = value.split("_", 2)
+                return int(version[1:]), int(issued_ns), client
+            except ValueError:
+                return None
+    return None
+
+
+def create_cookie_api_app():
+    """cookie_api 替身，单条和批量投递都接受。"""
+    app = FastAPI()
+    recorder = CookieApiRecorder()
+    app.state.recorder = recorder
+
+    @app.post("/api/refreshCookie")
+    async def refresh_cookie(request: Request):
+        recorder.record(await request.json())
+        return {"code": 200, "msg": "ok"}
+
+    return app
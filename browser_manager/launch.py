@@ -0,0 +1,78 @@
+import logging
+import os
+import sys
+
+logger = logging.getLogger(__name__)
+
+# 项目根目录下随项目分发的浏览器，各平台的可执行文件位置
+BUNDLED_EXECUTABLES = {
+    "win32": "Chrome-bin/chrome.exe",
+    "darwin": "Chrome-bin/Chromium.app/Contents/MacOS/Chromium",
+    "linux": "Chrome-bin/chrome",
+}
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# 所有启动配置都带的参数
+BASE_ARGS = [
+    "--no-sandbox",
+    "--disable-blink-features=AutomationControlled",
+]
+# lean 启动配置：监控页面大多在后台标签页，关闭后台节流保证其定时请求照常发出；
+# 不需要 GPU、扩展和各类后台服务，减少启动时间和常驻进程
+LEAN_ARGS = [
+    "--disable-background-timer-throttling",
+    "--disable-backgrounding-occluded-windows",
+    "--disable-renderer-backgrounding",
+    "--disable-gpu",
+    "--disable-extensions",
+    "--disable-component-extensions-with-background-pages",
+    "--disable-component-update",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--no-first-run",
+    "--no-default-browser-check",
+    "--mute-audio",
+]
+
+
+def _platform_key() -> str:
+    if sys.platform.startswith("win"):
+        return "win32"
+    if sys.platform == "darwin":
+        return "darwin"
+    return "linux"
+
+
+def resolve_executable(configured=None):
+    """
+    按顺序查找浏览器可执行文件：config 中指定的路径（字符串，或按平台 win32/darwin/linux 指定的字典）、
+    项目内 Chrome-bin 下的浏览器；都不存在时返回 None，使用 Playwright 自带的 Chromium。
+    """
+    platform = _platform_key()
+    if isinstance(configured, dict):
+        configured = configured.get(platform)
+    if configured:
+        path = os.path.abspath(os.path.expanduser(configured))
+        if os.path.isfile(path):
+            return path
+        logger.warning("Configured browser executable not found: %s", path)
+    bundled = os.path.join(PROJECT_ROOT, BUNDLED_EXECUTABLES[platform])
+    if os.path.isfile(bundled):
+        return bundled
+    return None
+
+
+def build_launch_options(config: dict) -> dict:
+    """
+    按 config 生成 chromium.launch 参数：headless_mode、browser_executable、
+    browser_profile(lean/default)、browser_args（追加的启动参数）。
+    """
+    args = list(BASE_ARGS)
+    if config.get("browser_profile", "lean") == "lean":
+        args.extend(LEAN_ARGS)
+    args.extend(arg for arg in config.get("browser_args", []) if arg not in args)
+    return {
+        "headless": config.get("headless_mode", False),
+        "executable_path": resolve_executable(config.get("browser_executable")),
+        "args": args,
+    }
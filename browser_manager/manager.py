@@ -1,90 +1,214 @@
 import asyncio
+import contextlib
+import hashlib
 import os
 import json
+import logging
+import time
+from collections import OrderedDict
 from playwright.async_api import async_playwright
+from browser_manager.launch import BASE_ARGS, resolve_executable
+
+logger = logging.getLogger(__name__)
+
+
+class ContextLimitError(Exception):
+    """context 数量已达 max_contexts，且现有 context 都有打开的页面，不能淘汰。"""
+
 
 class BrowserManager:
-    def __init__(self, user_data_dir_base: str = "./user_data"):
+    def __init__(self, user_data_dir_base: str = "./user_data", max_contexts: int = 0, launch_options: dict = None):
         self.playwright = None
         self.browser = None
-        self.contexts = {}  # user_id -> BrowserContext
+        self.contexts = OrderedDict()  # user_id -> BrowserContext，按最近使用排序（末尾最新）
         self.pages = {}  # (user_id, site_code) -> Page
+        self.page_urls = {}  # (user_id, site_code) -> 打开页面时的 url，用于回收后重新打开
+        self.max_contexts = max_contexts  # 同时存活的 context 上限，0 表示不限制
+        self._context_locks = {}  # user_id -> asyncio.Lock，避免并发创建同一用户的多个 context
+        # 设置了 max_contexts 时，上限检查、淘汰和新建 context 在同一把锁内完成，不同用户并发创建也不会超出上限
+        self._capacity_lock = asyncio.Lock()
+        self._page_locks = {}  # (user_id, site_code) -> asyncio.Lock
+        self._start_lock = asyncio.Lock()  # 避免并发重复启动浏览器
+        self._browser_hooks = []  # 浏览器启动后回调 hook(manager, browser)
+        self._page_hooks = []  # 页面创建后回调 hook(manager, page_key, page)
+        self._timing_hooks = []  # 耗时上报回调 hook(manager, operation, seconds)
+        self.headless = False
+        # chromium.launch 的 executable_path / args，由 launch.build_launch_options 生成；未指定时使用项目内的浏览器
+        self.launch_options = launch_options or {"executable_path": resolve_executable(), "args": list(BASE_ARGS)}
+        self.closing = False  # 正在主动关闭浏览器，期间的断开/关闭事件不视为异常
+        self._storage_hashes = {}  # user_id -> 最近一次写入文件的存储状态 hash，内容未变化时跳过写入
+        self._save_handles = {}  # user_id -> 延迟保存的 TimerHandle
+        self._save_tasks = set()  # 进行中的延迟保存任务，保持引用避免被回收
         self.user_data_dir_base = user_data_dir_base
         os.makedirs(self.user_data_dir_base, exist_ok=True) # 确保基础目录存在
 
+    def add_hooks(self, on_browser=None, on_page=None, on_timing=None):
+        """注册浏览器启动 / 页面创建 / 耗时上报回调，供崩溃监控、指标采集等订阅浏览器事件。"""
+        if on_browser:
+            self._browser_hooks.append(on_browser)
+        if on_page:
+            self._page_hooks.append(on_page)
+        if on_timing:
+            self._timing_hooks.append(on_timing)
+
+    def _run_hooks(self, hooks, *args):
+        for hook in hooks:
+            try:
+                hook(self, *args)
+            except Exception as e:
+                logger.exception("Error running browser hook %s: %s", hook, e)
+
     async def start_browser(self, headless=False):
         """初始化 Playwright 并启动浏览器。"""
+        async with self._start_lock:
+            await self._start_browser(headless)
+
+    async def _start_browser(self, headless):
         if self.browser and self.browser.is_connected():
-            print("Browser is already running.")
+            logger.info("Browser is already running.")
             return
 
-        self.playwright = await async_playwright().start()
+        self.headless = headless
+        playwright_manager = async_playwright()
         try:
+            self.playwright = await playwright_manager.start()
+            started = time.perf_counter()
             self.browser = await self.playwright.chromium.launch(
                 headless=headless,
-                # 使用相对路径，指向项目根目录下的 Chrome-bin/chrome.exe
-                executable_path=os.path.abspath(os.path.join(os.path.dirname(__file__), '../Chrome-bin/chrome.exe')),
-                args=[
-                        '--no-sandbox',
-                        "--disable-blink-features=AutomationControlled"
-                    ]
+                executable_path=self.launch_options.get("executable_path"),
+                args=self.launch_options.get("args", BASE_ARGS),
             )
-            print("Browser started successfully.")
+            elapsed = time.perf_counter() - started
+            logger.info("Browser started successfully in %.2fs (%s).", elapsed,
+                        self.launch_options.get("executable_path") or "Playwright Chromium")
+            self._run_hooks(self._timing_hooks, "launch", elapsed)
+            self._run_hooks(self._browser_hooks, self.browser)
+        except BaseException as e:
+            # 启动失败或被取消（如服务关闭时取消后台启动）都要停掉已启动的驱动进程
+            if not isinstance(e, asyncio.CancelledError):
+                logger.error("Error starting browser: %s", e)
+            await self._abort_start(playwright_manager)
+            raise
+
+    async def _abort_start(self, playwright_manager):
+        browser, self.browser, self.playwright = self.browser, None, None
+        if browser:
+            try:
+                await browser.close()
+            except Exception as e:
+                logger.warning("Error closing browser: %s", e)
+        try:
+            # start() 中途被取消时还拿不到 Playwright 对象，直接通过 context manager 停止连接
+            await playwright_manager.__aexit__()
         except Exception as e:
-            print(f"Error starting browser: {e}")
+            logger.warning("Error stopping Playwright: %s", e)
+
+    async def stop_browser(self):
+        """关闭所有 context 和 page，然后关闭浏览器并停止 Playwright；与启动互斥，不会关闭到一半启动的浏览器。"""
+        async with self._start_lock:
+            await self._stop_browser()
+
+    async def _stop_browser(self):
+        logger.info("Stopping browser: Closing all managed contexts...")
+        self.closing = True
+        try:
+            # 停止时并行保存所有 context 的状态
+            for handle in self._save_handles.values():
+                handle.cancel()
+            self._save_handles.clear()
+            await self.save_all_storage()
+            # 创建 user_id 列表，避免遍历时修改字典导致问题
+            all_user_ids = list(self.contexts.keys())
+            results = await asyncio.gather(
+                *(self.close_context(user_id, save_state=False) for user_id in all_user_ids), return_exceptions=True
+            )
+            for user_id, result in zip(all_user_ids, results):
+                if isinstance(result, Exception):
+                    # 浏览器已崩溃时关闭 context 可能失败，继续清理
+                    logger.warning("Error closing context for user_id %s: %s", user_id, result)
+
+            if self.browser:
+                try:
+                    await self.browser.close()
+                except Exception as e:
+                    logger.warning("Error closing browser: %s", e)
+                self.browser = None
+                logger.info("Browser closed.")
             if self.playwright:
                 await self.playwright.stop()
-            self.playwright = None
-            self.browser = None
-            raise
+                self.playwright = None
+                logger.info("Playwright stopped.")
+            self.contexts.clear()
+            self.pages.clear()
+        finally:
+            self.closing = False
 
-    async def stop_browser(self):
-        """关闭所有 context 和 page，然后关闭浏览器并停止 Playwright。"""
-        print("Stopping browser: Closing all managed contexts...")
-        # 创建 user_id 列表，避免遍历时修改字典导致问题
-        all_user_ids = list(self.contexts.keys())
-        for user_id in all_user_ids:
-            await self.close_context(user_id, save_state=True) # 停止时保存状态
-
-        if self.browser:
-            await self.browser.close()
-            self.browser = None
-            print("Browser closed.")
-        if self.playwright:
-            await self.playwright.stop()
-            self.playwright = None
-            print("Playwright stopped.")
-        self.contexts.clear()
-        self.pages.clear()
-
-    async def restart_browser(self, headless=False):
-        """重启浏览器。"""
-        print("Restarting browser...")
+    async def restart_browser(self, headless=None):
+        """重启浏览器，未指定 headless 时沿用上次启动的设置。"""
+        logger.info("Restarting browser...")
+        headless = self.headless if headless is None else headless
         # 数据保存应由 stop_browser 处理
         await self.stop_browser()
         await self.start_browser(headless=headless)
-        print("Browser restarted.")
+        logger.info("Browser restarted.")
 
     def _get_storage_state_path(self, user_id: str) -> str:
         """构建用户存储状态文件的路径。"""
         return os.path.join(self.user_data_dir_base, f"user_{user_id}_storage.json")
 
-    async def save_context_storage(self, user_id: str):
-        """将用户 context 的存储状态保存到文件。"""
+    @staticmethod
+    def _write_storage_file(path: str, raw: str):
+        """先写临时文件再替换，保证文件始终完整。"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(raw)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _read_storage_file(path: str) -> str:
+        with open(path, 'r') as f:
+            return f.read()
+
+    async def save_context_storage(self, user_id: str) -> bool:
+        """将用户 context 的存储状态保存到文件，内容未变化时跳过，写文件在线程中执行。"""
         if user_id not in self.contexts:
-            print(f"No active context for user_id: {user_id} to save.")
-            return
+            logger.debug("No active context for user_id: %s to save.", user_id)
+            return False
 
         context = self.contexts[user_id]
         if context: # 确保 context 不为 None
             storage_state_path = self._get_storage_state_path(user_id)
             try:
                 storage_state = await context.storage_state()
-                with open(storage_state_path, 'w') as f:
-                    json.dump(storage_state, f)
-                print(f"Saved storage state for user_id: {user_id} to {storage_state_path}")
+                raw = json.dumps(storage_state)
+                digest = hashlib.sha1(raw.encode('utf-8')).hexdigest()
+                if self._storage_hashes.get(user_id) == digest:
+                    return False
+                await asyncio.to_thread(self._write_storage_file, storage_state_path, raw)
+                self._storage_hashes[user_id] = digest
+                logger.debug("Saved storage state for user_id: %s to %s", user_id, storage_state_path)
+                return True
             except Exception as e:
-                print(f"Error saving storage state for user_id {user_id}: {e}")
+                logger.error("Error saving storage state for user_id %s: %s", user_id, e)
+        return False
+
+    async def save_all_storage(self) -> int:
+        """并行保存所有 context 的存储状态，返回实际写入的数量。"""
+        results = await asyncio.gather(*(self.save_context_storage(user_id) for user_id in list(self.contexts)))
+        return sum(1 for saved in results if saved)
+
+    def schedule_storage_save(self, user_id: str, delay: float = 5):
+        """延迟保存存储状态，delay 内的多次请求合并为一次（如 cookie 频繁变化时）。"""
+        if user_id in self._save_handles:
+            return
+
+        def fire():
+            self._save_handles.pop(user_id, None)
+            task = asyncio.create_task(self.save_context_storage(user_id), name=f"storage-save:{user_id}")
+            self._save_tasks.add(task)
+            task.add_done_callback(self._save_tasks.discard)
+
+        self._save_handles[user_id] = asyncio.get_running_loop().call_later(delay, fire)
 
     async def get_context(self, user_id: str):
         """
@@ -93,37 +217,49 @@ class BrowserManager:
         """
         if not self.browser or not self.browser.is_connected():
             # 如果未连接，尝试重启浏览器
-            print("Browser not connected. Attempting to restart...")
-            await self.start_browser(headless=self.browser.launch_options.get('headless', False) if self.browser and hasattr(self.browser, 'launch_options') else False)
+            logger.warning("Browser not connected. Attempting to restart...")
+            await self.start_browser(headless=self.headless)
             if not self.browser or not self.browser.is_connected():
                  raise Exception("Browser not started or disconnected. Call start_browser() first or check connection.")
 
+        async with self._context_locks.setdefault(user_id, asyncio.Lock()):
+            return await self._get_or_create_context(user_id)
+
+    async def _get_or_create_context(self, user_id: str):
         if user_id in self.contexts:
             # 检查 context 是否仍可用（如未关闭）
             # Playwright 的 context 没有简单的 is_connected 或 is_closed 属性可直接判断
             # 这里假设只要在字典中就是活跃的。
             # 如果后续操作失败，再在对应处处理。
-            print(f"Reusing existing context for user_id: {user_id}")
+            logger.debug("Reusing existing context for user_id: %s", user_id)
+            self.contexts.move_to_end(user_id)
             return self.contexts[user_id]
 
+        async with self._capacity_lock if self.max_contexts else contextlib.nullcontext():
+            if self.max_contexts and len(self.contexts) >= self.max_contexts:
+                await self._evict_context()
+            return await self._create_context(user_id)
+
+    async def _create_context(self, user_id: str):
         storage_state_path = self._get_storage_state_path(user_id)
         storage_state = None
         if os.path.exists(storage_state_path):
             try:
-                with open(storage_state_path, 'r') as f:
-                    storage_state = json.load(f)
-                print(f"Loaded storage state for user_id: {user_id} from {storage_state_path}")
+                raw = await asyncio.to_thread(self._read_storage_file, storage_state_path)
+                storage_state = json.loads(raw)
+                self._storage_hashes[user_id] = hashlib.sha1(json.dumps(storage_state).encode('utf-8')).hexdigest()
+                logger.info("Loaded storage state for user_id: %s from %s", user_id, storage_state_path)
             except Exception as e:
-                print(f"Error loading storage state for user_id {user_id} from {storage_state_path}: {e}. Creating new context without it.")
+                logger.warning("Error loading storage state for user_id %s from %s: %s. Creating new context without it.", user_id, storage_state_path, e)
                 # 可选：备份损坏的文件 os.rename(storage_state_path, storage_state_path + ".bak")
 
-        print(f"Creating new context for user_id: {user_id}")
+        logger.info("Creating new context for user_id: %s", user_id)
         try:
             context = await self.browser.new_context(storage_state=storage_state)
             self.contexts[user_id] = context
             return context
         except Exception as e:
-            print(f"Error creating new context for user_id {user_id}: {e}")
+            logger.error("Error creating new context for user_id %s: %s", user_id, e)
             raise
 
     async def get_page(self, user_id: str, site_code: str, url: str):
@@ -132,15 +268,22 @@ class BrowserManager:
         页面由 (user_id, site_code) 唯一标识。
         """
         page_key = (user_id, site_code)
+        async with self._page_locks.setdefault(page_key, asyncio.Lock()):
+            return await self._get_or_create_page(user_id, site_code, url)
+
+    async def _get_or_create_page(self, user_id: str, site_code: str, url: str):
+        page_key = (user_id, site_code)
 
         if page_key in self.pages:
             page = self.pages[page_key]
             # 检查页面是否已关闭
             if not page.is_closed():
-                print(f"Reusing existing page for user: {user_id}, site_code: {site_code}")
+                logger.debug("Reusing existing page for user: %s, site_code: %s", user_id, site_code)
+                if user_id in self.contexts:
+                    self.contexts.move_to_end(user_id)
                 return page
             else:
-                print(f"Page for user_id: {user_id}, site_code: {site_code} was closed. Creating a new one.")
+                logger.info("Page for user_id: %s, site_code: %s was closed. Creating a new one.", user_id, site_code)
                 del self.pages[page_key] # 移除已关闭页面
 
         context = await self.get_context(user_id)
@@ -149,10 +292,15 @@ class BrowserManager:
 
         page = await context.new_page()
         self.pages[page_key] = page
-        print(f"Created new page for user_id: {user_id}, site_code: {site_code}")
+        if url:
+            self.page_urls[page_key] = url
+        logger.info("Created new page for user_id: %s, site_code: %s", user_id, site_code)
+        self._run_hooks(self._page_hooks, page_key, page)
 
         if page.url == "about:blank":
+            started = time.perf_counter()
             await page.goto(url, timeout=20000)
+            self._run_hooks(self._timing_hooks, "goto", time.perf_counter() - started)
         return page
 
     async def close_context(self, user_id: str, save_state: bool = True):
@@ -161,24 +309,91 @@ class BrowserManager:
             if save_state:
                 await self.save_context_storage(user_id)
             context = self.contexts.pop(user_id)
-            await context.close() # 这也会关闭该 context 下所有页面。
 
-            # 从追踪中移除相关页面
+            # 先从追踪中移除相关页面，关闭事件触发时即可识别为主动关闭
             pages_to_remove = [pk for pk in self.pages if pk[0] == user_id]
             for pk in pages_to_remove:
                 del self.pages[pk]
-            print(f"Closed context and associated pages for user_id: {user_id}")
+                self.page_urls.pop(pk, None)
+            await context.close() # 这也会关闭该 context 下所有页面。
+            logger.info("Closed context and associated pages for user_id: %s", user_id)
         else:
-            print(f"No active context found for user_id: {user_id} to close.")
+            logger.debug("No active context found for user_id: %s to close.", user_id)
 
     async def close_page(self, user_id: str, site_code: str):
         """关闭指定页面，关闭前先保存一次 storage_state。"""
         await self.save_context_storage(user_id)
         page_key = (user_id, site_code)
+        self.page_urls.pop(page_key, None)
         if page_key in self.pages:
             page = self.pages.pop(page_key)
             if not page.is_closed():
                 await page.close()
-            print(f"Closed page for user_id: {user_id}, site_code: {site_code}")
+            logger.info("Closed page for user_id: %s, site_code: %s", user_id, site_code)
         else:
-            print(f"No active page found for (user_id: {user_id}, site_code: {site_code}) to close.")
\ No newline at end of file
+            logger.debug("No active page found for (user_id: %s, site_code: %s) to close.", user_id, site_code)
+
+    def current_page(self, user_id: str, site_code: str):
+        """返回当前登记的页面（可能已被回收替换），不会创建新页面。"""
+        return self.pages.get((user_id, site_code))
+
+    def _busy_users(self) -> set:
+        """有打开的页面（含监控页面）或正在打开页面的用户，其 context 不能淘汰。"""
+        busy = {pk[0] for pk, page in self.pages.items() if not page.is_closed()}
+        busy.update(pk[0] for pk, lock in self._page_locks.items() if lock.locked())
+        return busy
+
+    async def _evict_context(self):
+        """
+        淘汰最久未使用且没有打开页面的 context，淘汰前保存存储状态。
+        所有 context 都有页面时拒绝新建：淘汰监控页面所在的 context 会让监控任务重新打开页面，
+        进而淘汰其它用户，形成循环。
+        """
+        busy_users = self._busy_users()
+        victim = next((uid for uid in self.contexts if uid not in busy_users), None)
+        if victim is None:
+            raise ContextLimitError(f"Context limit {self.max_contexts} reached and every context has open pages")
+        logger.info("Context limit %s reached, evicting least recently used user_id: %s", self.max_contexts, victim)
+        await self.close_context(victim, save_state=True)
+
+    async def get_page_heap_size(self, page) -> int:
+        """通过 CDP Performance.getMetrics 读取页面 JS 堆已用字节数。"""
+        session = await page.context.new_cdp_session(page)
+        try:
+            await session.send("Performance.enable")
+            result = await session.send("Performance.getMetrics")
+        finally:
+            await session.detach()
+        metrics = {m["name"]: m["value"] for m in result.get("metrics", [])}
+        return int(metrics.get("JSHeapUsedSize", 0))
+
+    async def recycle_page(self, user_id: str, site_code: str):
+        """关闭页面并在同一 context 中按原 url 重新打开，返回新页面。"""
+        page_key = (user_id, site_code)
+        url = self.page_urls.get(page_key)
+        old_page = self.pages.pop(page_key, None)
+        if old_page and not old_page.is_closed():
+            await old_page.close()
+        page = await self.get_page(user_id, site_code, url)
+        logger.info("Recycled page for user_id: %s, site_code: %s", user_id, site_code)
+        return page
+
+    async def recycle_heavy_pages(self, heap_limit_bytes: int) -> list:
+        """回收 JS 堆超过 heap_limit_bytes 的页面，返回被回收的页面 key。"""
+        recycled = []
+        for page_key, page in list(self.pages.items()):
+            if page.is_closed() or page_key not in self.page_urls:
+                continue
+            try:
+                heap_size = await self.get_page_heap_size(page)
+            except Exception as e:
+                logger.warning("Error reading heap size for %s: %s", page_key, e)
+                continue
+            if heap_size > heap_limit_bytes:
+                logger.warning("Page %s JS heap %.1fMB exceeds limit, recycling.", page_key, heap_size / 1048576)
+                try:
+                    await self.recycle_page(*page_key)
+                    recycled.append(page_key)
+                except Exception as e:
+                    logger.error("Error recycling page %s: %s", page_key, e)
+        return recycled
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import math
+import zlib
+from browser_manager.manager import BrowserManager
+
+logger = logging.getLogger(__name__)
+
+class ShardedBrowserManager:
+    """
+    将用户分散到 N 个独立的 Playwright 连接 / Chromium 进程上。
+    用户按 user_id 的稳定 hash 分配到固定分片，接口与 BrowserManager 保持一致。
+    """
+
+    def __init__(self, shards: int = 2, user_data_dir_base: str = "./user_data", max_contexts: int = 0, launch_options: dict = None):
+        if shards < 1:
+            raise ValueError("shards must be >= 1")
+        self.user_data_dir_base = user_data_dir_base
+        # context 总上限平均分给各分片
+        per_shard = math.ceil(max_contexts / shards) if max_contexts else 0
+        self.shards = [BrowserManager(user_data_dir_base, max_contexts=per_shard, launch_options=launch_options) for _ in range(shards)]
+
+    def add_hooks(self, on_browser=None, on_page=None, on_timing=None):
+        for shard in self.shards:
+            shard.add_hooks(on_browser=on_browser, on_page=on_page, on_timing=on_timing)
+
+    def shard_index(self, user_id: str) -> int:
+        """user_id -> 分片序号，使用 crc32 保证进程重启后分配不变。"""
+        return zlib.crc32(str(user_id).encode("utf-8")) % len(self.shards)
+
+    def shard_for(self, user_id: str) -> BrowserManager:
+        return self.shards[self.shard_index(user_id)]
+
+    @property
+    def contexts(self) -> dict:
+        """所有分片的 context 汇总（只读视图）。"""
+        merged = {}
+        for shard in self.shards:
+            merged.update(shard.contexts)
+        return merged
+
+    @property
+    def pages(self) -> dict:
+        """所有分片的页面汇总（只读视图）。"""
+        merged = {}
+        for shard in self.shards:
+            merged.update(shard.pages)
+        return merged
+
+    async def start_browser(self, headless=False):
+        """并行启动所有分片的浏览器。"""
+        await asyncio.gather(*(shard.start_browser(headless=headless) for shard in self.shards))
+        logger.info("Started %s browser shards.", len(self.shards))
+
+    async def stop_browser(self):
+        """并行关闭所有分片。"""
+        results = await asyncio.gather(*(shard.stop_browser() for shard in self.shards), return_exceptions=True)
+        for index, result in enumerate(results):
+            if isinstance(result, Exception):
+                logger.error("Error stopping browser shard %s: %s", index, result)
+
+    async def restart_browser(self, headless=None):
+        logger.info("Restarting browser shards...")
+        await asyncio.gather(*(shard.restart_browser(headless=headless) for shard in self.shards))
+        logger.info("Browser shards restarted.")
+
+    async def save_context_storage(self, user_id: str):
+        await self.shard_for(user_id).save_context_storage(user_id)
+
+    async def save_all_storage(self) -> int:
+        results = await asyncio.gather(*(shard.save_all_storage() for shard in self.shards))
+        return sum(results)
+
+    def schedule_storage_save(self, user_id: str, delay: float = 5):
+        self.shard_for(user_id).schedule_storage_save(user_id, delay)
+
+    async def get_context(self, user_id: str):
+        return await self.shard_for(user_id).get_context(user_id)
+
+    async def get_page(self, user_id: str, site_code: str, url: str):
+        return await self.shard_for(user_id).get_page(user_id, site_code, url)
+
+    async def close_context(self, user_id: str, save_state: bool = True):
+        await self.shard_for(user_id).close_context(user_id, save_state=save_state)
+
+    async def close_page(self, user_id: str, site_code: str):
+        await self.shard_for(user_id).close_page(user_id, site_code)
+
+    def current_page(self, user_id: str, site_code: str):
+        return self.shard_for(user_id).current_page(user_id, site_code)
+
+    async def recycle_page(self, user_id: str, site_code: str):
+        return await self.shard_for(user_id).recycle_page(user_id, site_code)
+
+    async def recycle_heavy_pages(self, heap_limit_bytes: int) -> list:
+        results = await asyncio.gather(*(shard.recycle_heavy_pages(heap_limit_bytes) for shard in self.shards))
+        return [page_key for recycled in results for page_key in recycled]
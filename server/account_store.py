@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+"""
+账号（用户-站点）存储：默认直接读写 sites.json，account_backend=sqlite 时改用带索引的 SQLite 表，
+两种后端提供相同的分页筛选和单行增删改接口；首次启用 SQLite 时从 sites.json 导入一次
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 站点行的可编辑字段
+ACCOUNT_FIELDS = ("code", "account_type", "account", "password", "contact", "description")
+# 精确匹配（可多选）的筛选字段；account / contact 默认按包含匹配，开启 account_prefix_search 后按前缀匹配（可用索引），
+# description 始终按包含匹配
+LIST_FILTERS = ("user_id", "code", "account_type")
+PREFIX_FILTERS = ("account", "contact")
+
+
+def normalize_filters(params: dict) -> dict:
+    """把查询参数整理为筛选条件：多选字段统一为 int 列表，文本字段去掉首尾空白，空值丢弃。"""
+    filters = {}
+    for key in LIST_FILTERS:
+        value = params.get(key)
+        if value is None or value == "" or value == []:
+            continue
+        values = value if isinstance(value, list) else str(value).split(",")
+        filters[key] = [int(v) for v in values if str(v).strip() != ""]
+    for key in ("account", "contact", "description"):
+        value = (params.get(key) or "").strip()
+        if value:
+            filters[key] = value
+    return filters
+
+
+def _match(row: dict, filters: dict, prefix_search: bool = False) -> bool:
+    for key in LIST_FILTERS:
+        if key in filters and row.get(key) not in filters[key]:
+            return False
+    for key in PREFIX_FILTERS:
+        if key not in filters:
+            continue
+        value = str(row.get(key) or "")
+        if not (value.startswith(filters[key]) if prefix_search else filters[key] in value):
+            return False
+    if "description" in filters and filters["description"] not in str(row.get("description") or ""):
+        return False
+    return True
+
+
+def _page(total: int, items: list, page: int, page_size: int) -> dict:
+    return {"total": total, "page": page, "page_size": page_size, "items": items}
+
+
+class JsonAccountStore:
+    """
+    sites.json 后端：每个站点带持久化的 id 字段，由顶层 next_account_id 计数器分配，只增不减，
+    删除后其它行的 id 不变、已删除的 id 也不会复用；没有 id 的站点在启动时和每次写入时补齐，查询不写文件。
+    """
+
+    backend = "json"
+
+    def __init__(self, config_store, load, save, prefix_search: bool = False):
+        self.config_store = config_store
+        self.prefix_search = prefix_search
+        self._load = load  # 返回 sites.json 副本
+        self._save = save  # 写回 sites.json，失败时抛出异常
+        self._lock = threading.Lock()  # 增删改在线程池中并发执行，读取-修改-写回和 id 分配需整体互斥
+
+    def get_user(self, user_id):
+        return self.config_store.get_user(user_id)
+
+    def get_site(self, user_id, code):
+        return self.config_store.get_site(user_id, code)
+
+    def users(self) -> list:
+        return self.config_store.data().get("users", [])
+
+    def _rows(self, users):
+        for user in users:
+            for site in user.get("sites", []):
+                yield user, site
+
+    def _next_id(self, data: dict) -> int:
+        # 计数器不小于已有的最大 id + 1，兼容手工编辑过的 sites.json
+        max_id = max((site["id"] for _, site in self._rows(data.get("users", [])) if isinstance(site.get("id"), int)), default=0)
+        row_id = max(data.get("next_account_id", 1), max_id + 1)
+        data["next_account_id"] = row_id + 1
+        return row_id
+
+    def _assign_ids(self, data: dict) -> bool:
+        """给没有 id 的站点分配 id，返回是否有改动。"""
+        missing = [site for _, site in self._rows(data.get("users", [])) if not isinstance(site.get("id"), int)]
+        for site in missing:
+            site["id"] = self._next_id(data)
+        return bool(missing)
+
+    def assign_missing_ids(self) -> bool:
+        """给 sites.json 中没有 id 的站点补齐 id 并写回，返回是否有改动。"""
+        with self._lock:
+            data = self._load()
+            if not self._assign_ids(data):
+                return False
+            self._save(data)
+            return True
+
+    def query(self, filters: dict, page: int = 1, page_size: int = None) -> dict:
+        items = []
+        # 运行中手工加入 sites.json 的站点在下次写入时才分配 id，此前 id 为 None
+        for user, site in self._rows(self.users()):
+            row = {"id": site.get("id"), "user_id": user.get("user_id"), **{k: site.get(k) for k in ACCOUNT_FIELDS}}
+            if _match(row, filters, self.prefix_search):
+                items.append(row)
+        if page_size is None:
+            return _page(len(items), items, 1, len(items))
+        start = (page - 1) * page_size
+        return _page(len(items), items[start:start + page_size], page, page_size)
+
+    def create(self, user_id: int, fields: dict) -> int:
+        with self._lock:
+            data = self._load()
+            self._assign_ids(data)
+            users = data.setdefault("users", [])
+            user = next((u for u in users if u.get("user_id") == user_id), None)
+            if user is None:
+                user = {"user_id": user_id, "sites": []}
+                users.append(user)
+            site = {"id": self._next_id(data), **{k: fields.get(k) for k in ACCOUNT_FIELDS}}
+            user.setdefault("sites", []).append(site)
+            self._save(data)
+            return site["id"]
+
+    def update(self, row_id: int, fields: dict) -> bool:
+        with self._lock:
+            data = self._load()
+            changed = self._assign_ids(data)
+            for user, site in self._rows(data.get("users", [])):
+                if site["id"] == row_id:
+                    site.update({k: v for k, v in fields.items() if k in ACCOUNT_FIELDS})
+                    self._save(data)
+                    return True
+            if changed:
+                self._save(data)
+            return False
+
+    def delete(self, row_id: int) -> bool:
+        with self._lock:
+            data = self._load()
+            changed = self._assign_ids(data)
+            for user, site in self._rows(data.get("users", [])):
+                if site["id"] == row_id:
+                    user["sites"].remove(site)
+                    self._save(data)
+                    return True
+            if changed:
+                self._save(data)
+            return False
+
+
+class SqliteAccountStore:
+    """
+    SQLite 后端：accounts 表每行一个站点，按查询字段建索引。get_user/get_site/users 在事件循环中频繁调用，
+    改为读内存索引，每次写入后在锁内重建，读取时既不执行 SQL 也不等锁。
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, path: str, prefix_search: bool = False):
+        self.path = path
+        self.prefix_search = prefix_search
+        self._lock = threading.Lock()  # 同步接口会被事件循环和线程池中的接口同时调用
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS accounts ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, code INTEGER NOT NULL, "
+            "account_type INTEGER, account TEXT, password TEXT, contact TEXT, description TEXT);"
+            "CREATE INDEX IF NOT EXISTS idx_accounts_user_code ON accounts (user_id, code);"
+            "CREATE INDEX IF NOT EXISTS idx_accounts_code ON accounts (code);"
+            "CREATE INDEX IF NOT EXISTS idx_accounts_account_type ON accounts (account_type);"
+            "CREATE INDEX IF NOT EXISTS idx_accounts_account ON accounts (account);"
+            "CREATE INDEX IF NOT EXISTS idx_accounts_contact ON accounts (contact);"
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);"
+        )
+        self._conn.commit()
+        self._users = {}  # user_id -> {"user_id": ..., "sites": [...]}
+        self._sites = {}  # (user_id, code) -> site
+        with self._lock:
+            self._reindex()
+
+    def _site(self, row) -> dict:
+        return {k: row[k] for k in ACCOUNT_FIELDS}
+
+    def _reindex(self):
+        """按当前表内容重建内存索引，调用方需持有 self._lock；整体替换引用，读取方不会看到一半的结果。"""
+        users, sites = {}, {}
+        for row in self._conn.execute("SELECT * FROM accounts ORDER BY id"):
+            site = self._site(row)
+            users.setdefault(row["user_id"], {"user_id": row["user_id"], "sites": []})["sites"].append(site)
+            # 重复的 (user_id, code) 取最早的一条，与 sites.json 的行为一致
+            sites.setdefault((row["user_id"], row["code"]), site)
+        self._users, self._sites = users, sites
+
+    def get_user(self, user_id):
+        return self._users.get(user_id)
+
+    def get_site(self, user_id, code):
+        return self._sites.get((user_id, code))
+
+    def users(self) -> list:
+        return list(self._users.values())
+
+    def _where(self, filters: dict):
+        clauses, args = [], []
+        for key in LIST_FILTERS:
+            if key in filters:
+                clauses.append(f"{key} IN ({','.join('?' * len(filters[key]))})")
+                args.extend(filters[key])
+        for key in PREFIX_FILTERS:
+            if key not in filters:
+                continue
+            if self.prefix_search:
+                # 前缀匹配写成范围条件，可以用上索引
+                clauses.append(f"{key} >= ? AND {key} < ?")
+                args.extend([filters[key], filters[key] + "\U0010ffff"])
+            else:
+                clauses.append(f"instr({key}, ?) > 0")
+                args.append(filters[key])
+        if "description" in filters:
+            clauses.append("instr(description, ?) > 0")
+            args.append(filters["description"])
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", args
+
+    def query(self, filters: dict, page: int = 1, page_size: int = None) -> dict:
+        where, args = self._where(filters)
+        with self._lock:
+            total = self._conn.execute(f"SELECT COUNT(*) FROM accounts{where}", args).fetchone()[0]
+            sql = f"SELECT * FROM accounts{where} ORDER BY id"
+            if page_size is not None:
+                sql += " LIMIT ? OFFSET ?"
+                args = args + [page_size, (page - 1) * page_size]
+            rows = self._conn.execute(sql, args).fetchall()
+        items = [{"id": row["id"], "user_id": row["user_id"], **self._site(row)} for row in rows]
+        return _page(total, items, page, page_size if page_size is not None else total)
+
+    def create(self, user_id: int, fields: dict) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                f"INSERT INTO accounts (user_id, {', '.join(ACCOUNT_FIELDS)}) VALUES (?{', ?' * len(ACCOUNT_FIELDS)})",
+                [user_id] + [fields.get(k) for k in ACCOUNT_FIELDS],
+            )
+            self._conn.commit()
+            self._reindex()
+        return cursor.lastrowid
+
+    def update(self, row_id: int, fields: dict) -> bool:
+        fields = {k: v for k, v in fields.items() if k in ACCOUNT_FIELDS}
+        if not fields:
+            return self._exists(row_id)
+        with self._lock:
+            cursor = self._conn.execute(
+                f"UPDATE accounts SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ?", list(fields.values()) + [row_id]
+            )
+            self._conn.commit()
+            if cursor.rowcount > 0:
+                self._reindex()
+        return cursor.rowcount > 0
+
+    def _exists(self, row_id: int) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM accounts WHERE id = ?", (row_id,)).fetchone() is not None
+
+    def delete(self, row_id: int) -> bool:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM accounts WHERE id = ?", (row_id,))
+            self._conn.commit()
+            if cursor.rowcount > 0:
+                self._reindex()
+        return cursor.rowcount > 0
+
+    def import_users(self, users: list) -> int:
+        """从 sites.json 的 users 导入，只执行一次（记录在 meta 表中）。"""
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM meta WHERE key = 'imported'").fetchone():
+                return 0
+            rows = [
+                [user.get("user_id")] + [site.get(k) for k in ACCOUNT_FIELDS]
+                for user in users
+                for site in user.get("sites", [])
+            ]
+            self._conn.executemany(
+                f"INSERT INTO accounts (user_id, {', '.join(ACCOUNT_FIELDS)}) VALUES (?{', ?' * len(ACCOUNT_FIELDS)})", rows
+            )
+            self._conn.execute("INSERT INTO meta (key, value) VALUES ('imported', datetime('now'))")
+            self._conn.commit()
+            self._reindex()
+        return len(rows)
+
+
+def open_account_store(config: dict, config_store, load, save, default_dir: str):
+    """按 config.account_backend 创建账号存储。"""
+    prefix_search = config.get("account_prefix_search", False)
+    if config.get("account_backend", "json") != "sqlite":
+        store = JsonAccountStore(config_store, load, save, prefix_search)
+        try:
+            if store.assign_missing_ids():
+                logger.info("[账号存储] 已为 sites.json 中没有 id 的站点分配 id")
+        except Exception as e:
+            logger.warning("[账号存储] 分配站点 id 失败，将在下次写入时重试: %s", e)
+        return store
+    path = config.get("account_db_path") or os.path.join(default_dir, "accounts.db")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    store = SqliteAccountStore(path, prefix_search)
+    imported = store.import_users(config_store.data().get("users", []))
+    if imported:
+        logger.info("[账号存储] 已从 sites.json 导入 %s 个站点账号到 %s", imported, path)
+    return store
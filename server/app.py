@@ -2,84 +2,71 @@ from fastapi import FastAPI, Request, HTTPException
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 import os
-import json
 from typing import Dict, Optional, List
-from contextlib import asynccontextmanager
-from browser_manager.manager import BrowserManager
+from contextlib import asynccontextmanager, suppress
+from browser_manager.manager import BrowserManager, ContextLimitError
+from browser_manager.sharded import ShardedBrowserManager
+from browser_manager.launch import build_launch_options
+from server.config_store import ConfigStore
+from server.cookie_sender import close_cookie_sender
+from server.refresh_scheduler import RefreshScheduler
+from server.monitor_registry import MonitorRegistry
+from server.watchdog import BrowserWatchdog
+from server.event_bus import event_bus, publish_monitor_state
+from server.delivery_queue import start_delivery_queue, stop_delivery_queue, get_delivery_queue
+from server.capture_sink import start_capture_sink, stop_capture_sink, get_capture_sink
+from server.task_supervisor import supervisor
+from server import profiling
+from server.startup import startup, FirstRequestTimer
+from server import metrics
+from server.logger import setup_logging
+from server.account_store import open_account_store, normalize_filters
 import server.monitor_task
 import asyncio
-import traceback
-from fastapi.responses import RedirectResponse
+import json
+import logging
+import time
+from fastapi.responses import RedirectResponse, StreamingResponse, PlainTextResponse, Response, JSONResponse
+
+logger = logging.getLogger(__name__)
 
 # 获取配置文件路径
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-SITES_CONFIG_FILE = os.path.join(BASE_DIR, "sites.json")
+# 可用环境变量 MONITOR_SITES_FILE 指定其它配置文件（如压测时使用临时配置）
+SITES_CONFIG_FILE = os.environ.get("MONITOR_SITES_FILE") or os.path.join(BASE_DIR, "sites.json")
 os.makedirs(BASE_DIR, exist_ok=True)
 
-# 页面刷新定时任务
-async def periodic_refresh_pages(app):
-    """每5分钟刷新一次所有正在监控的页面"""
-    config = get_config_item("config")
-    refresh_interval = config.get("refresh_interval", 3000)
-    # 用户活动检测时间阈值（秒），默认60秒内有活动则认为用户正在操作
-    user_activity_threshold = config.get("user_activity_threshold", 60)
-    
+# 页面内存检查定时任务
+async def periodic_memory_check(app):
+    """定期回收 JS 堆超过 page_heap_limit_mb 的页面，回收后在原url重新打开"""
     while True:
         try:
-            await asyncio.sleep(refresh_interval)  # 默认5分钟刷新一次
-            tasks = getattr(app.state, "monitor_tasks", {})
-            pages = getattr(app.state, "monitor_pages", {})
-            
-            if not pages:
-                print("[定时刷新] 没有正在监控的页面")
+            config = get_config_item("config")
+            await asyncio.sleep(config.get("memory_check_interval", 60))
+            heap_limit_mb = config.get("page_heap_limit_mb", 0)
+            if not heap_limit_mb:
                 continue
-                
-            print(f"[定时刷新] 开始检查 {len(pages)} 个页面")
-            
-            for task_key, page in list(pages.items()):
-                try:
-                    task = tasks.get(task_key)
-                    if task and not task.done() and not task.cancelled():
-                        # 检查页面是否有用户活动
-                        try:
-                            # 注入检测代码（如果尚未注入）
-                            await page.evaluate("""
-                                if (!window._lastUserActivity) {
-                                    window._lastUserActivity = Date.now();
-                                    document.addEventListener('mousemove', () => { window._lastUserActivity = Date.now(); });
-                                    document.addEventListener('keydown', () => { window._lastUserActivity = Date.now(); });
-                                    document.addEventListener('click', () => { window._lastUserActivity = Date.now(); });
-                                    document.addEventListener('scroll', () => { window._lastUserActivity = Date.now(); });
-                                }
-                            """)
-                            
-                            # 获取最后活动时间
-                            last_activity = await page.evaluate("window._lastUserActivity || 0")
-                            current_time = await page.evaluate("Date.now()")
-                            idle_time = (current_time - last_activity) / 1000  # 转为秒
-                            
-                            if idle_time < user_activity_threshold:
-                                print(f"[定时刷新] 检测到用户活动，跳过刷新: {task_key}, 闲置时间: {idle_time:.1f}秒")
-                                continue
-                            
-                            # 用户长时间未操作，可以安全刷新
-                            print(f"[定时刷新] 用户无活动，执行刷新: {task_key}, 闲置时间: {idle_time:.1f}秒")
-                            await page.reload()
-                        except Exception as activity_error:
-                            # 检测失败，保守处理，不刷新页面
-                            print(f"[警告] 检测用户活动失败: {task_key}, 错误: {activity_error}")
-                            # 如果检测失败则默认刷新
-                            await page.reload()
-                    else:
-                        pages.pop(task_key, None)
-                except Exception as e:
-                    print(f"[异常] 刷新页面失败: {task_key}, 错误: {e}\n{traceback.format_exc()}")
+            recycled = await app.state.browser_manager.recycle_heavy_pages(int(heap_limit_mb * 1024 * 1024))
+            if recycled:
+                logger.info("[内存检查] 已回收 %s 个页面: %s", len(recycled), recycled)
         except asyncio.CancelledError:
-            print("[定时刷新] 定时任务被取消")
             break
         except Exception as e:
-            print(f"[异常] 定时刷新任务异常: {e}\n{traceback.format_exc()}")
-            await asyncio.sleep(60)
+            logger.exception("[异常] 页面内存检查异常: %s", e)
+
+# 存储状态定时快照任务
+async def periodic_storage_snapshot(app):
+    """定期保存所有 context 的存储状态，内容未变化的跳过，避免崩溃时丢失会话"""
+    while True:
+        try:
+            await asyncio.sleep(get_config_item("config").get("storage_snapshot_interval", 300))
+            saved = await app.state.browser_manager.save_all_storage()
+            if saved:
+                logger.info("[状态快照] 已保存 %s 个用户的存储状态", saved)
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            logger.exception("[异常] 存储状态快照异常: %s", e)
 
 class SiteConfig(BaseModel):
     code: int
@@ -104,93 +91,198 @@ class GlobalConfig(BaseModel):
     performance_mode: bool
     media_codes: Dict[str, MediaTypeConfig]
 
+class AccountConfig(SiteConfig):
+    user_id: int
+
+class AccountUpdate(BaseModel):
+    code: Optional[int] = None
+    account_type: Optional[int] = None
+    account: Optional[str] = None
+    password: Optional[str] = None
+    contact: Optional[str] = None
+    description: Optional[str] = None
+
 class AllConfig(BaseModel):
     users: List[UserConfig]
     config: GlobalConfig
 
+config_store = ConfigStore(SITES_CONFIG_FILE)
+# 日志在后台线程中输出，配置修改后需重启生效
+setup_logging(config_store.get_config())
+
 def load_all_data() -> dict:
-    """读取整个 sites.json 文件，返回字典对象。"""
-    if not os.path.exists(SITES_CONFIG_FILE):
-        return {}
-    try:
-        with open(SITES_CONFIG_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"Error loading {SITES_CONFIG_FILE}: {e}")
-        return {}
+    """读取整个 sites.json 文件，返回字典对象（副本，可修改后 save_all_data 写回）。"""
+    return config_store.load()
 
 def save_all_data(data: dict):
-    """保存整个 sites.json 文件内容。"""
+    """保存整个 sites.json 文件内容，失败时返回 500，调用方不会误以为已保存。"""
     try:
-        with open(SITES_CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=4, ensure_ascii=False)
+        config_store.save(data)
     except Exception as e:
-        print(f"Error saving {SITES_CONFIG_FILE}: {e}")
+        logger.error("Error saving %s: %s", SITES_CONFIG_FILE, e)
+        raise HTTPException(status_code=500, detail=f"保存{SITES_CONFIG_FILE}失败: {e}")
+
+# 用户/站点账号存储，config.account_backend=sqlite 时使用 SQLite，修改后需重启生效
+accounts = open_account_store(config_store.get_config(), config_store, load_all_data, save_all_data,
+                              config_store.get_config().get("user_data_dir", "./user_data"))
 
 def get_config_item(item_type, item_id=None, sub_item_id=None):
-    """统一获取配置项的函数"""
-    data = load_all_data()
-    
+    """统一获取配置项的函数（走内存索引，返回值只读）"""
     if item_type == "user":
-        return next((user for user in data.get("users", []) if user["user_id"] == item_id), None)
+        return accounts.get_user(item_id)
     elif item_type == "site":
-        user = next((user for user in data.get("users", []) if user["user_id"] == item_id), None)
-        return next((site for site in user.get("sites", []) if site["code"] == sub_item_id), None) if user else None
+        return accounts.get_site(item_id, sub_item_id)
     elif item_type == "media":
-        return data.get("config", {}).get("media_codes", {}).get(str(item_id), None)
+        return config_store.get_media(item_id)
     elif item_type == "account_types":
-        return data.get("config", {}).get("account_types", {})
+        return config_store.get_config().get("account_types", {})
     elif item_type == "config":
-        return data.get("config", {})
+        return config_store.get_config()
     elif item_type == "media_codes":
-        return data.get("config", {}).get("media_codes", {})
+        return config_store.get_config().get("media_codes", {})
     elif item_type == "users":
-        return data.get("users", [])
+        return accounts.users()
     return None
 
 @asynccontextmanager
 async def lifespan(app):
     # 启动初始化
-    browser_manager = BrowserManager()
-    await browser_manager.start_browser(headless=False)
+    # browser_shards > 1 时按 user_id 分片到多个 Playwright 连接 / Chromium 进程
+    config = get_config_item("config")
+    shards = config.get("browser_shards", 1)
+    max_contexts = config.get("max_contexts", 0)
+    user_data_dir = config.get("user_data_dir", "./user_data")
+    # 启动配置：headless_mode、按平台查找的浏览器路径、lean 启动参数
+    launch_options = build_launch_options(config)
+    if shards > 1:
+        browser_manager = ShardedBrowserManager(shards, user_data_dir, max_contexts=max_contexts, launch_options=launch_options)
+    else:
+        browser_manager = BrowserManager(user_data_dir, max_contexts=max_contexts, launch_options=launch_options)
     app.state.browser_manager = browser_manager
+    # 崩溃监控需在浏览器启动前注册，才能订阅到浏览器和页面事件
+    app.state.watchdog = BrowserWatchdog(app)
+    app.state.watchdog.install(browser_manager)
+    browser_manager.add_hooks(on_timing=lambda manager, operation, seconds: metrics.page_operation_seconds.observe(seconds, operation))
+    # 首次成功启动浏览器时恢复上次运行中的监控任务，无论由后台启动、按需启动还是崩溃监控重建触发
+    app.state.monitors_restored = False
+    browser_manager.add_hooks(on_browser=lambda manager, browser: _on_browser_started(app))
     
     # 初始化监控任务和页面字典
     app.state.monitor_tasks = {}
     app.state.monitor_pages = {}
+    app.state.monitor_buffers = {}
+    # 监控任务共用页面：monitor_aliases 每个站点的 task_key -> 实际运行的任务 key，
+    # monitor_groups 运行的任务 key -> 共用该页面的站点集合，monitor_shares (user_id, url, domains) -> 运行的任务 key
+    app.state.monitor_aliases = {}
+    app.state.monitor_groups = {}
+    app.state.monitor_shares = {}
+    app.state.monitor_registry = MonitorRegistry(os.path.join(browser_manager.user_data_dir_base, "monitors.json"))
+    app.state.warmup = {}
     
     # 启动定时刷新页面任务
-    app.state.refresh_task = asyncio.create_task(periodic_refresh_pages(app))
+    app.state.refresh_scheduler = RefreshScheduler(app)
+    app.state.refresh_task = asyncio.create_task(app.state.refresh_scheduler.run(), name="refresh-scheduler")
+    # 启动页面内存检查任务
+    app.state.memory_task = asyncio.create_task(periodic_memory_check(app), name="memory-check")
+    # 启动存储状态定时快照
+    app.state.snapshot_task = asyncio.create_task(periodic_storage_snapshot(app), name="storage-snapshot")
+    # 启动崩溃监控轮询
+    app.state.watchdog_task = asyncio.create_task(app.state.watchdog.run(), name="watchdog")
+    # 启动事件循环延迟探测
+    app.state.loop_lag_task = asyncio.create_task(
+        metrics.monitor_event_loop_lag(config.get("loop_lag_interval", 0.5)), name="loop-lag")
+    
+    # 启用时启动Cookie投递队列，继续投递上次未完成的积压
+    if config.get("delivery_queue"):
+        queue_path = config.get("delivery_queue_path", os.path.join(browser_manager.user_data_dir_base, "outbox.db"))
+        await start_delivery_queue(queue_path, config)
+    # 启用时把监控请求和cookie变化写入压缩分段文件
+    if config.get("capture_sink"):
+        start_capture_sink(config, browser_manager.user_data_dir_base)
     
-    print("Browser manager started.")
-    print("Page refresh task started (every 5 minutes).")
-    print(f"Site configurations will be loaded from: {os.path.abspath(SITES_CONFIG_FILE)}")
+    # 浏览器在后台启动，HTTP接口不必等待
+    app.state.browser_task = asyncio.create_task(launch_browser(app, launch_options["headless"]), name="browser-launch")
+    
+    logger.info("Page refresh scheduler started.")
+    logger.info("Site configurations will be loaded from: %s", os.path.abspath(SITES_CONFIG_FILE))
+    startup.mark("api_ready")
     
     yield
     
     # 关闭时取消定时刷新任务
     if hasattr(app.state, "refresh_task"):
         app.state.refresh_task.cancel()
-        print("Page refresh task stopped.")
+        logger.info("Page refresh task stopped.")
+    if hasattr(app.state, "memory_task"):
+        app.state.memory_task.cancel()
+    if hasattr(app.state, "watchdog_task"):
+        app.state.watchdog_task.cancel()
+    if hasattr(app.state, "snapshot_task"):
+        app.state.snapshot_task.cancel()
+    if hasattr(app.state, "loop_lag_task"):
+        app.state.loop_lag_task.cancel()
+    
+    # 等待后台启动和监控恢复真正结束，启动到一半的浏览器由 start_browser 自行清理
+    for name in ("browser_task", "restore_task"):
+        task = getattr(app.state, name, None)
+        if task is not None:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+    await app.state.monitor_registry.flush()
+    
+    # 关闭Cookie投递队列和连接池
+    await stop_delivery_queue()
+    close_cookie_sender()
+    stop_capture_sink()
     
     # 关闭浏览器
-    print("Stopping browser manager...")
+    logger.info("Stopping browser manager...")
     try:
         await browser_manager.stop_browser()
     except Exception as e:
-        print(f"Error during browser shutdown: {e}")
-    print("Browser manager stopped.")
-    print("Server shutdown.")
+        logger.error("Error during browser shutdown: %s", e)
+    logger.info("Browser manager stopped.")
+    logger.info("Server shutdown.")
+
+async def launch_browser(app, headless: bool):
+    """后台启动浏览器；失败时记录状态，之后首次打开页面时会再次尝试启动。"""
+    try:
+        await app.state.browser_manager.start_browser(headless=headless)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        startup.browser_failed(e)
+        logger.error("[启动] 浏览器启动失败: %s", e)
+        return
+    startup.browser_ready()
+    logger.info("Browser manager started.")
+
+def _on_browser_started(app):
+    """浏览器启动后的回调：后台启动失败后按需启动成功时恢复就绪状态；只在第一次启动成功时恢复监控。"""
+    if startup.browser == "failed":
+        startup.browser_ready()
+    if not app.state.monitors_restored:
+        app.state.monitors_restored = True
+        app.state.restore_task = asyncio.create_task(restore_monitors(app), name="restore-monitors")
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(FirstRequestTimer, tracker=startup)
 app.mount("/static", StaticFiles(directory="server/static", html=True), name="static")
 
+@app.exception_handler(ContextLimitError)
+async def context_limit_handler(request: Request, exc: ContextLimitError):
+    """context 已达上限且都有打开的页面时，返回 503 而不是淘汰正在监控的用户。"""
+    return JSONResponse({"detail": f"浏览器context已达上限，请先停止部分监控或调大max_contexts: {exc}"}, status_code=503)
+
+metrics.install_app_gauges(app)
+
 # ------------------ 监控配置信息接口 ------------------
 
 @app.get("/api/sites")
 def get_sites():
     """聚合返回所有站点。"""
-    return load_all_data()
+    return {**config_store.data(), "users": accounts.users()}
 
 @app.get("/api/config")
 def get_config():
@@ -207,6 +299,40 @@ def get_users():
     """返回所有用户及其站点。"""
     return get_config_item("users")
 
+@app.get("/api/accounts")
+def list_accounts(request: Request, page: int = 1, page_size: int = 20):
+    """
+    分页筛选站点账号，每行带 id 和 user_id。
+    user_id / code / account_type 可用逗号分隔多个值，account / contact 默认按包含匹配（account_prefix_search 开启时按前缀），description 按包含匹配。
+    """
+    try:
+        filters = normalize_filters(dict(request.query_params))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="user_id、code、account_type必须为整数")
+    page = max(page, 1)
+    page_size = min(max(page_size, 1), 500)
+    return accounts.query(filters, page, page_size)
+
+@app.post("/api/accounts")
+def create_account(account: AccountConfig):
+    """新增一个站点账号。"""
+    fields = account.model_dump()
+    return {"id": accounts.create(fields.pop("user_id"), fields)}
+
+@app.put("/api/accounts/{account_id}")
+def update_account(account_id: int, account: AccountUpdate):
+    """修改站点账号，只更新传入的字段。"""
+    if not accounts.update(account_id, account.model_dump(exclude_unset=True)):
+        raise HTTPException(status_code=404, detail=f"未找到账号: {account_id}")
+    return {"msg": "已保存"}
+
+@app.delete("/api/accounts/{account_id}")
+def delete_account(account_id: int):
+    """删除站点账号。"""
+    if not accounts.delete(account_id):
+        raise HTTPException(status_code=404, detail=f"未找到账号: {account_id}")
+    return {"msg": "已删除"}
+
 # ------------------ browser 操作相关接口 ------------------
 
 async def _cleanup_browser_state(request: Request):
@@ -219,13 +345,19 @@ async def _cleanup_browser_state(request: Request):
     pages = getattr(request.app.state, "monitor_pages", {})
     for page_key in list(pages.keys()):
         del pages[page_key]
+    getattr(request.app.state, "monitor_buffers", {}).clear()
+    request.app.state.monitor_aliases.clear()
+    request.app.state.monitor_groups.clear()
+    request.app.state.monitor_shares.clear()
+    request.app.state.watchdog.health.clear()
 
 @app.post("/api/browser/start")
 async def api_start_browser(request: Request):
     """启动浏览器，可选headless参数。"""
     params = await request.json()
-    headless = params.get("headless", False)
+    headless = params.get("headless", get_config_item("config").get("headless_mode", False))
     await request.app.state.browser_manager.start_browser(headless=headless)
+    startup.browser_ready()
     return {"msg": "浏览器已启动", "headless": headless}
 
 @app.post("/api/browser/stop")
@@ -239,7 +371,12 @@ async def api_stop_browser(request: Request):
 async def api_restart_browser(request: Request):
     """重启浏览器。"""
     await _cleanup_browser_state(request)
+    # 重启后由本接口恢复监控，启动回调不再重复恢复
+    request.app.state.monitors_restored = True
     await request.app.state.browser_manager.restart_browser()
+    startup.browser_ready()
+    # 重启后按登记表恢复监控任务
+    request.app.state.restore_task = asyncio.create_task(restore_monitors(request.app), name="restore-monitors")
     return {"msg": "浏览器已重启"}
 
 # ------------------ 监控任务相关接口 ------------------
@@ -268,39 +405,145 @@ async def validate_monitor_params(params):
         
     return user_id, site_code, media
 
+def _monitor_key(user_id, site_code, media) -> str:
+    """监控任务唯一key"""
+    return f"{user_id}:{site_code}:{media['url']}"
+
+def _share_key(user_id, media) -> tuple:
+    """url 和 domains 都相同的媒体才能共用页面，否则cookie的域名筛选不同。"""
+    return str(user_id), media['url'], tuple(sorted(media.get("domains") or []))
+
+def _drop_group(app, leader: str):
+    """移除运行任务及其共用站点的登记。"""
+    user_id, site_code, url = leader.split(":", 2)
+    site_codes = app.state.monitor_groups.pop(leader, None) or set()
+    for code in site_codes | {site_code}:
+        key = f"{user_id}:{code}:{url}"
+        if app.state.monitor_aliases.get(key) == leader:
+            del app.state.monitor_aliases[key]
+    media = get_config_item("media", site_code)
+    if media and app.state.monitor_shares.get(_share_key(user_id, media)) == leader:
+        del app.state.monitor_shares[_share_key(user_id, media)]
+
+async def _open_monitor(app, user_id, site_code, media):
+    """打开页面并启动监控任务，已有同key任务时先取消旧任务，沿用原有请求缓冲区。"""
+    task_key = _monitor_key(user_id, site_code, media)
+    aliases = app.state.monitor_aliases
+    
+    # 共用页面模式：同一用户下 url/domains 相同的站点加入已有任务，不再打开新页面
+    if get_config_item("config").get("share_pages_by_url"):
+        leader = app.state.monitor_shares.get(_share_key(user_id, media))
+        if leader is not None and leader != task_key:
+            app.state.monitor_groups[leader].add(str(site_code))
+            aliases[task_key] = leader
+            app.state.monitor_registry.add(user_id, site_code)
+            publish_monitor_state(task_key, "running")
+            return task_key
+        # 打开页面前先登记，并发启动的同组站点会直接加入
+        app.state.monitor_shares[_share_key(user_id, media)] = task_key
+    
+    tasks = app.state.monitor_tasks
+    old_task = tasks.pop(task_key, None)
+    if old_task:
+        old_task.cancel()
+    site_codes = app.state.monitor_groups.setdefault(task_key, set())
+    site_codes.add(str(site_code))
+    aliases[task_key] = task_key
+    
+    try:
+        # 先获取页面，用于定时刷新
+        page = await app.state.browser_manager.get_page(str(user_id), str(site_code), media['url'])
+    except Exception:
+        _drop_group(app, task_key)
+        raise
+    # 存储页面对象，用于定时刷新
+    app.state.monitor_pages[task_key] = page
+    
+    # 启动任务，捕获的请求写入环形缓冲区
+    buffers = app.state.monitor_buffers
+    if task_key not in buffers:
+        buffers[task_key] = server.monitor_task.create_capture_buffer()
+    tasks[task_key] = asyncio.create_task(
+        server.monitor_task.monitor_fetch_requests(
+            app.state.browser_manager, str(user_id), str(site_code), media['url'], duration=0x7fffffff, buffer=buffers[task_key],
+            site_codes=site_codes,
+        ),
+        name=f"monitor:{task_key}",
+    )
+    app.state.monitor_registry.add(user_id, site_code)
+    publish_monitor_state(task_key, "running")
+    startup.mark("first_monitor")
+    return task_key
+
+async def _close_monitor(app, user_id, site_code, media) -> bool:
+    """停止监控任务并关闭页面，任务不存在时返回 False。"""
+    task_key = _monitor_key(user_id, site_code, media)
+    
+    # 从任务字典中移除
+    app.state.monitor_registry.remove(user_id, site_code)
+    leader = app.state.monitor_aliases.pop(task_key, None)
+    if leader is None:
+        return False
+    server.monitor_task.cookie_cache.forget((str(user_id), str(site_code)))
+    site_codes = app.state.monitor_groups.get(leader)
+    if site_codes is not None:
+        site_codes.discard(str(site_code))
+        if site_codes:
+            # 页面还在为其它站点服务，只停止向该站点投递
+            publish_monitor_state(task_key, "stopped")
+            return True
+    _drop_group(app, leader)
+    task = app.state.monitor_tasks.pop(leader, None)
+    if task:
+        task.cancel()
+    
+    # 从页面字典中移除
+    app.state.monitor_pages.pop(leader, None)
+    app.state.watchdog.health.pop(leader, None)
+    app.state.monitor_buffers.pop(leader, None)
+    
+    # 页面登记在启动该任务的站点下
+    leader_user_id, leader_site_code, _ = leader.split(":", 2)
+    await app.state.browser_manager.close_page(leader_user_id, leader_site_code)
+    publish_monitor_state(task_key, "stopped")
+    return True
+
+def _monitor_status(app, task_key: str) -> dict:
+    leader = app.state.monitor_aliases.get(task_key)
+    task = app.state.monitor_tasks.get(leader) if leader else None
+    if not task:
+        return {"code": 404, "exists": False, "running": False, "state": "missing", "msg": "未找到该监控任务"}
+    running = not task.done() and not task.cancelled()
+    health = app.state.watchdog.health.get(leader)
+    # 共用其它站点页面的任务，返回实际运行的任务 key
+    shared = {"shared_with": leader} if leader != task_key else {}
+    if running and health:
+        # 页面或浏览器异常，正在自动恢复
+        return {"code": 200, "exists": True, "running": False, "state": "degraded", "reason": health["reason"], "since": health["since"],
+                "msg": f"监控任务异常，正在恢复: {task_key}", **shared}
+    return {"code": 200, "exists": True, "running": running, "state": "running" if running else "stopped",
+            "msg": f"监控任务{'正在运行' if running else '已停止'}: {task_key}", **shared}
+
 @app.post("/api/monitor/start")
 async def api_monitor_start(request: Request):
     """启动指定用户、站点、url的Fetch/XHR监控任务。"""
     params = await request.json()
     user_id, site_code, media = await validate_monitor_params(params)
-    
-    # 唯一key
-    task_key = f"{user_id}:{site_code}:{media['url']}"
+    task_key = _monitor_key(user_id, site_code, media)
     
     # 检查是否已存在
-    if hasattr(request.app.state, "monitor_tasks") and task_key in request.app.state.monitor_tasks:
+    if task_key in request.app.state.monitor_aliases:
         # 调用get_page
         await request.app.state.browser_manager.get_page(str(user_id), str(site_code), media['url'])
         raise HTTPException(status_code=400, detail="该监控任务已存在")
     
-    # 先获取页面，用于定时刷新
     try:
-        page = await request.app.state.browser_manager.get_page(str(user_id), str(site_code), media['url'])
-        # 存储页面对象，用于定时刷新
-        request.app.state.monitor_pages[task_key] = page
+        await _open_monitor(request.app, user_id, site_code, media)
+    except ContextLimitError:
+        raise
     except Exception as e:
-        print(f"[异常] 获取页面失败: {e}\n{traceback.format_exc()}")
+        logger.exception("[异常] 获取页面失败: %s", e)
         raise HTTPException(status_code=500, detail=f"获取页面失败: {e}")
-    
-    # 启动任务
-    task = asyncio.create_task(
-        server.monitor_task.monitor_fetch_requests(
-            request.app.state.browser_manager, str(user_id), str(site_code), media['url'], duration=0x7fffffff
-        )
-    )
-    if not hasattr(request.app.state, "monitor_tasks"):
-        request.app.state.monitor_tasks = {}
-    request.app.state.monitor_tasks[task_key] = task
     return {"msg": f"已启动监控任务: {task_key}"}
 
 @app.post("/api/monitor/stop")
@@ -308,22 +551,9 @@ async def api_monitor_stop(request: Request):
     """暂停指定监控任务。"""
     params = await request.json()
     user_id, site_code, media = await validate_monitor_params(params)
-    task_key = f"{user_id}:{site_code}:{media['url']}"
-    
-    # 从任务字典中移除
-    tasks = getattr(request.app.state, "monitor_tasks", {})
-    task = tasks.get(task_key)
-    if not task:
+    task_key = _monitor_key(user_id, site_code, media)
+    if not await _close_monitor(request.app, user_id, site_code, media):
         raise HTTPException(status_code=404, detail=f"未找到监控任务: {task_key}")
-    task.cancel()
-    del tasks[task_key]
-    
-    # 从页面字典中移除
-    pages = getattr(request.app.state, "monitor_pages", {})
-    if task_key in pages:
-        del pages[task_key]
-    
-    await request.app.state.browser_manager.close_page(str(user_id), str(site_code))
     return {"msg": f"已暂停监控任务: {task_key}"}
 
 @app.post("/api/monitor/restart")
@@ -333,29 +563,13 @@ async def api_monitor_restart(request: Request):
     user_id, site_code, media = await validate_monitor_params(params)
     
     # 先停再启
-    task_key = f"{user_id}:{site_code}:{media['url']}"
-    tasks = getattr(request.app.state, "monitor_tasks", {})
-    old_task = tasks.get(task_key)
-    if old_task:
-        old_task.cancel()
-        del tasks[task_key]
-    
-    # 先获取页面，用于定时刷新
     try:
-        page = await request.app.state.browser_manager.get_page(str(user_id), str(site_code), media['url'])
-        # 存储页面对象，用于定时刷新
-        request.app.state.monitor_pages[task_key] = page
+        task_key = await _open_monitor(request.app, user_id, site_code, media)
+    except ContextLimitError:
+        raise
     except Exception as e:
-        print(f"[异常] 获取页面失败: {e}\n{traceback.format_exc()}")
+        logger.exception("[异常] 获取页面失败: %s", e)
         raise HTTPException(status_code=500, detail=f"获取页面失败: {e}")
-    
-    # 启动新任务
-    task = asyncio.create_task(
-        server.monitor_task.monitor_fetch_requests(
-            request.app.state.browser_manager, str(user_id), str(site_code), media['url'], duration=0x7fffffff
-        )
-    )
-    tasks[task_key] = task
     return {"msg": f"已重启监控任务: {task_key}"}
 
 @app.post("/api/monitor/status")
@@ -363,14 +577,324 @@ async def api_monitor_status(request: Request):
     """查询指定监控任务的状态。"""
     params = await request.json()
     user_id, site_code, media = await validate_monitor_params(params)
+    return _monitor_status(request.app, _monitor_key(user_id, site_code, media))
+
+async def restore_monitors(app):
+    """
+    按登记表恢复监控任务：先并发预建各用户的 context（加载 user_{id}_storage.json），
+    再按 config.restore_rate 控制页面导航的启动速率，避免浏览器被瞬间打满。
+    """
+    config = get_config_item("config")
+    if not config.get("restore_monitors", True):
+        return
+    items = app.state.monitor_registry.items()
+    started = time.monotonic()
+    warmup = app.state.warmup = {"total": len(items), "restored": 0, "failed": 0, "seconds": None, "done": False}
+    if not items:
+        warmup["done"] = True
+        return
+    logger.info("[恢复监控] 开始恢复 %s 个监控任务", len(items))
+    
+    semaphore = asyncio.Semaphore(config.get("bulk_concurrency", 8))
+    browser_manager = app.state.browser_manager
+    
+    async def create_context(user_id):
+        async with semaphore:
+            try:
+                await browser_manager.get_context(str(user_id))
+            except Exception as e:
+                logger.warning("[恢复监控] 预建context失败: user_id=%s %s", user_id, e)
+    
+    await asyncio.gather(*(create_context(user_id) for user_id in dict.fromkeys(user_id for user_id, _ in items)))
+    
+    interval = 1 / config.get("restore_rate", 5)
+    
+    async def restore_one(index, user_id, site_code):
+        await asyncio.sleep(index * interval)
+        async with semaphore:
+            try:
+                user_id, site_code, media = await validate_monitor_params({"user_id": user_id, "site_code": site_code})
+                if _monitor_key(user_id, site_code, media) not in app.state.monitor_aliases:
+                    await _open_monitor(app, user_id, site_code, media)
+                warmup["restored"] += 1
+            except Exception as e:
+                warmup["failed"] += 1
+                if isinstance(e, HTTPException):
+                    # 配置中已不存在的站点不再恢复
+                    app.state.monitor_registry.remove(user_id, site_code)
+                detail = e.detail if isinstance(e, HTTPException) else e
+                logger.warning("[恢复监控] 恢复失败: user_id=%s site_code=%s %s", user_id, site_code, detail)
+    
+    await asyncio.gather(*(restore_one(index, user_id, site_code) for index, (user_id, site_code) in enumerate(items)))
+    warmup["seconds"] = round(time.monotonic() - started, 3)
+    warmup["done"] = True
+    logger.info("[恢复监控] 已恢复 %s/%s 个监控任务，耗时 %s秒", warmup['restored'], warmup['total'], warmup['seconds'])
+
+@app.get("/api/monitor/warmup")
+def api_monitor_warmup(request: Request):
+    """返回最近一次自动恢复监控任务的进度和耗时。"""
+    return request.app.state.warmup
+
+# ------------------ 批量监控接口 ------------------
+
+def _resolve_bulk_items(params) -> list:
+    """
+    解析批量请求的目标，返回去重后的 (user_id, site_code) 列表。
+    支持 items: [{user_id, site_code}, ...]，或按 user_id / media_code 筛选（可组合）。
+    """
+    items = params.get("items")
+    if items is not None:
+        pairs = [(item.get("user_id"), item.get("site_code")) for item in items]
+    else:
+        user_id = params.get("user_id")
+        media_code = params.get("media_code")
+        if user_id is None and media_code is None:
+            raise HTTPException(status_code=400, detail="请提供items，或user_id/media_code筛选条件")
+        try:
+            filters = normalize_filters({"user_id": user_id, "code": media_code})
+        except ValueError:
+            raise HTTPException(status_code=400, detail="user_id和media_code必须为整数")
+        pairs = [(row["user_id"], row["code"]) for row in accounts.query(filters)["items"]]
+    return list(dict.fromkeys(pairs))
+
+async def _bulk_run(params, action) -> dict:
+    """对每个目标执行 action(user_id, site_code, media)，并发数受 config.bulk_concurrency 限制。"""
+    pairs = _resolve_bulk_items(params)
+    semaphore = asyncio.Semaphore(get_config_item("config").get("bulk_concurrency", 8))
+    
+    async def run_one(user_id, site_code):
+        result = {"user_id": user_id, "site_code": site_code}
+        try:
+            user_id, site_code, media = await validate_monitor_params({"user_id": user_id, "site_code": site_code})
+            async with semaphore:
+                result.update(await action(user_id, site_code, media))
+        except HTTPException as e:
+            result.update({"ok": False, "msg": e.detail})
+        except Exception as e:
+            logger.warning("[异常] 批量操作失败: %s:%s %s", user_id, site_code, e)
+            result.update({"ok": False, "msg": str(e)})
+        return result
+    
+    results = await asyncio.gather(*(run_one(user_id, site_code) for user_id, site_code in pairs))
+    succeeded = sum(1 for result in results if result.get("ok"))
+    return {"total": len(results), "succeeded": succeeded, "failed": len(results) - succeeded, "results": results}
+
+@app.post("/api/monitor/bulk/start")
+async def api_monitor_bulk_start(request: Request):
+    """批量启动监控任务，已存在的任务跳过，并发打开页面。"""
+    params = await request.json()
+    
+    async def start(user_id, site_code, media):
+        task_key = _monitor_key(user_id, site_code, media)
+        if task_key in request.app.state.monitor_aliases:
+            return {"ok": True, "msg": f"监控任务已存在: {task_key}"}
+        await _open_monitor(request.app, user_id, site_code, media)
+        return {"ok": True, "msg": f"已启动监控任务: {task_key}"}
+    
+    return await _bulk_run(params, start)
+
+@app.post("/api/monitor/bulk/stop")
+async def api_monitor_bulk_stop(request: Request):
+    """批量停止监控任务。"""
+    params = await request.json()
+    
+    async def stop(user_id, site_code, media):
+        task_key = _monitor_key(user_id, site_code, media)
+        if not await _close_monitor(request.app, user_id, site_code, media):
+            return {"ok": False, "msg": f"未找到监控任务: {task_key}"}
+        return {"ok": True, "msg": f"已暂停监控任务: {task_key}"}
+    
+    return await _bulk_run(params, stop)
+
+@app.post("/api/monitor/bulk/status")
+async def api_monitor_bulk_status(request: Request):
+    """批量查询监控任务状态；不传参数时返回所有监控任务。"""
+    params = await request.json()
+    if not params:
+        keys = list(request.app.state.monitor_aliases)
+    else:
+        media_codes = get_config_item("media_codes")
+        keys = [
+            f"{user_id}:{site_code}:{media_codes[str(site_code)]['url']}"
+            for user_id, site_code in _resolve_bulk_items(params)
+            if str(site_code) in media_codes
+        ]
+    return {"total": len(keys), "results": [{"task_key": key, **_monitor_status(request.app, key)} for key in keys]}
+
+@app.post("/api/monitor/requests")
+async def api_monitor_requests(request: Request):
+    """查询指定监控任务最近捕获的N条请求。"""
+    params = await request.json()
+    user_id, site_code, media = await validate_monitor_params(params)
+    try:
+        limit = int(params.get("limit", 50))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="limit必须为整数")
 
     task_key = f"{user_id}:{site_code}:{media['url']}"
-    tasks = getattr(request.app.state, "monitor_tasks", {})
-    task = tasks.get(task_key)
-    if not task:
-        return {"code": 404, "exists": False, "running": False, "msg": "未找到该监控任务"}
-    running = not task.done() and not task.cancelled()
-    return {"code": 200, "exists": True, "running": running, "msg": f"监控任务{'正在运行' if running else '已停止'}: {task_key}"}
+    leader = request.app.state.monitor_aliases.get(task_key, task_key)
+    buffer = getattr(request.app.state, "monitor_buffers", {}).get(leader)
+    if buffer is None:
+        raise HTTPException(status_code=404, detail=f"未找到监控任务: {task_key}")
+    # 限制在 1..capacity 之间
+    limit = min(max(limit, 1), buffer.capacity)
+    return {"total": buffer.total, "capacity": buffer.capacity, "requests": buffer.recent(limit)}
+
+@app.get("/api/ready")
+def api_ready():
+    """就绪检查：浏览器启动完成返回 200，启动中或失败返回 503；附带各启动阶段距进程启动的秒数。"""
+    return JSONResponse(startup.snapshot(), status_code=200 if startup.ready else 503)
+
+@app.get("/api/watchdog/stats")
+def api_watchdog_stats(request: Request):
+    """返回崩溃监控的检测/恢复统计，以及当前处于 degraded 状态的监控。"""
+    watchdog = request.app.state.watchdog
+    return {**watchdog.stats, "degraded": watchdog.health}
+
+@app.get("/api/delivery/stats")
+async def api_delivery_stats():
+    """返回Cookie投递队列的统计和积压数量。"""
+    queue = get_delivery_queue()
+    if queue is None:
+        return {"enabled": False}
+    return {"enabled": True, "pending": await queue.pending(), **queue.stats}
+
+@app.get("/api/tasks/stats")
+def api_task_stats():
+    """返回各监控任务组的队列深度、执行中任务数和丢弃/合并/拒绝计数。"""
+    return supervisor.stats()
+
+@app.get("/api/capture/stats")
+def api_capture_stats():
+    """返回请求采集的写入/丢弃统计和写队列深度。"""
+    sink = get_capture_sink()
+    if sink is None:
+        return {"enabled": False}
+    return {"enabled": True, "directory": sink.directory, "queue_depth": sink.queue_depth(), **sink.stats}
+
+@app.get("/metrics")
+def api_metrics():
+    """Prometheus 文本格式的指标。"""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+# ------------------ 诊断接口 ------------------
+
+def _require_profiling():
+    """诊断接口需在 config 中开启 profiling_endpoints，修改 sites.json 后无需重启即可生效。"""
+    if not get_config_item("config").get("profiling_endpoints", False):
+        raise HTTPException(status_code=403, detail="诊断接口未开启（config.profiling_endpoints）")
+
+def _download(data: bytes, filename: str) -> Response:
+    return Response(data, media_type="application/octet-stream",
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@app.get("/api/admin/profile/cpu")
+async def api_profile_cpu(seconds: float = 10, format: str = "pstats", sort: str = "cumulative", limit: int = 50):
+    """
+    采集 seconds 秒（最长120秒）事件循环线程的 CPU 剖析。
+    format=pstats 下载 .prof 文件（pstats / snakeviz 可打开），format=text 返回按 sort 排序的前 limit 行。
+    """
+    _require_profiling()
+    if format not in ("pstats", "text"):
+        raise HTTPException(status_code=400, detail="format 只能为 pstats 或 text")
+    try:
+        profile = await profiling.profile_event_loop(min(max(seconds, 0.1), 120))
+    except profiling.ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if format == "text":
+        return PlainTextResponse(profiling.pstats_text(profile, sort, limit))
+    return _download(profiling.pstats_bytes(profile), time.strftime("cpu-%Y%m%d-%H%M%S.prof"))
+
+@app.get("/api/admin/tracemalloc")
+def api_tracemalloc_status():
+    """返回 tracemalloc 是否开启、已追踪内存和已保存的快照列表。"""
+    _require_profiling()
+    return profiling.tracemalloc_status()
+
+@app.post("/api/admin/tracemalloc/start")
+def api_tracemalloc_start(frames: int = 10):
+    """开启内存分配追踪，frames 为每次分配保留的栈帧数；追踪期间所有分配都会变慢。"""
+    _require_profiling()
+    profiling.start_tracemalloc(frames)
+    return profiling.tracemalloc_status()
+
+@app.post("/api/admin/tracemalloc/stop")
+def api_tracemalloc_stop():
+    _require_profiling()
+    profiling.stop_tracemalloc()
+    return profiling.tracemalloc_status()
+
+@app.post("/api/admin/tracemalloc/snapshot")
+async def api_tracemalloc_snapshot(group_by: str = "lineno", limit: int = 20):
+    """采集快照，返回快照 id 和占用最多的分配位置。"""
+    _require_profiling()
+    try:
+        snapshot_id = await asyncio.to_thread(profiling.take_snapshot)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    top = await asyncio.to_thread(profiling.snapshot_top, snapshot_id, group_by, limit)
+    return {"id": snapshot_id, "top": top}
+
+@app.get("/api/admin/tracemalloc/diff")
+async def api_tracemalloc_diff(base: int, target: int, group_by: str = "lineno", limit: int = 20):
+    """target 快照相对 base 快照的分配增长，用于定位泄漏。"""
+    _require_profiling()
+    if profiling.get_snapshot(base) is None or profiling.get_snapshot(target) is None:
+        raise HTTPException(status_code=404, detail="快照不存在或已被淘汰")
+    return {"base": base, "target": target,
+            "diff": await asyncio.to_thread(profiling.snapshot_diff, base, target, group_by, limit)}
+
+@app.get("/api/admin/tracemalloc/snapshot/{snapshot_id}")
+async def api_tracemalloc_download(snapshot_id: int):
+    """下载快照文件，可用 tracemalloc.Snapshot.load 读回。"""
+    _require_profiling()
+    if profiling.get_snapshot(snapshot_id) is None:
+        raise HTTPException(status_code=404, detail="快照不存在或已被淘汰")
+    data = await asyncio.to_thread(profiling.snapshot_bytes, snapshot_id)
+    return _download(data, f"snapshot-{snapshot_id}.tracemalloc")
+
+@app.get("/api/admin/tasks")
+async def api_admin_tasks(origin: Optional[str] = None, stack_limit: int = 5):
+    """列出存活的 asyncio 任务及调用栈，按来源（monitor、monitor-check、refresh-scheduler、delivery-queue 等）统计。"""
+    _require_profiling()
+    return profiling.list_tasks(origin, stack_limit)
+
+@app.get("/api/refresh/stats")
+def api_refresh_stats(request: Request):
+    """返回定时刷新调度的统计信息。"""
+    scheduler = request.app.state.refresh_scheduler
+    return {**scheduler.stats, "scheduled_pages": len(scheduler.deadlines)}
+
+# ------------------ 实时事件接口 ------------------
+
+@app.get("/api/events")
+async def api_events(request: Request, user_id: Optional[str] = None, site_code: Optional[str] = None,
+                     media_code: Optional[str] = None, types: Optional[str] = None):
+    """
+    以 SSE 推送 cookie_change / monitor_state 事件。
+    筛选参数均可用逗号分隔多个值，如 /api/events?user_id=1,2&types=cookie_change
+    """
+    def split(value):
+        return value.split(",") if value else None
+    
+    subscriber = event_bus.subscribe(
+        max_queue=get_config_item("config").get("event_queue_size", 100),
+        user_ids=split(user_id), site_codes=split(site_code), media_codes=split(media_code), types=split(types),
+    )
+    
+    async def stream():
+        try:
+            while not await request.is_disconnected():
+                event = await subscriber.get(timeout=15)
+                if event is None:
+                    # 保持连接
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        finally:
+            event_bus.unsubscribe(subscriber)
+    
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 @app.get("/")
 def root():
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+监控请求的定长环形缓冲区：每个监控任务只保留最近 capacity 条精简记录，内存占用不随运行时长增长
+"""
+
+from collections import deque
+from typing import Iterable, List
+
+# 可采集的字段，headers/post_data 体积较大，默认不采集
+CAPTURE_FIELDS = ("url", "method", "resource_type", "timestamp", "headers", "post_data")
+DEFAULT_CAPTURE_FIELDS = ("url", "method", "resource_type", "timestamp")
+
+
+class CapturedRequest:
+    __slots__ = CAPTURE_FIELDS
+
+    def __init__(self, url=None, method=None, resource_type=None, timestamp=None, headers=None, post_data=None):
+        self.url = url
+        self.method = method
+        self.resource_type = resource_type
+        self.timestamp = timestamp
+        self.headers = headers
+        self.post_data = post_data
+
+    def to_dict(self, fields: Iterable[str] = CAPTURE_FIELDS) -> dict:
+        return {field: getattr(self, field) for field in fields}
+
+
+class RequestRingBuffer:
+    def __init__(self, capacity: int = 200, fields: Iterable[str] = DEFAULT_CAPTURE_FIELDS):
+        unknown = set(fields) - set(CAPTURE_FIELDS)
+        if unknown:
+            raise ValueError(f"不支持的采集字段: {sorted(unknown)}")
+        self.capacity = capacity
+        self.fields = tuple(fields)
+        self.total = 0  # 累计采集条数（含已被覆盖的）
+        self._records = deque(maxlen=capacity)
+
+    def capture(self, request, timestamp: float) -> CapturedRequest:
+        """按配置字段从 Playwright Request 采集一条记录。"""
+        fields = self.fields
+        record = CapturedRequest(
+            url=request.url if "url" in fields else None,
+            method=request.method if "method" in fields else None,
+            resource_type=request.resource_type if "resource_type" in fields else None,
+            timestamp=timestamp if "timestamp" in fields else None,
+            headers=dict(request.headers) if "headers" in fields else None,
+            post_data=request.post_data if "post_data" in fields else None,
+        )
+        self._records.append(record)
+        self.total += 1
+        return record
+
+    def recent(self, limit: int = None) -> List[dict]:
+        """按时间顺序返回最近 limit 条记录。"""
+        records = list(self._records)
+        if limit is not None:
+            records = records[-limit:] if limit > 0 else []
+        return [record.to_dict(self.fields) for record in records]
+
+    def __len__(self):
+        return len(self._records)
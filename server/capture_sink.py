@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+监控请求和 cookie 变化的落盘采集：调用方只把事件放入有界队列，满了直接丢弃并计数；
+后台线程批量写入 gzip 压缩的 JSONL 分段文件，按大小或时长切换新分段，只保留最近若干个分段。
+read_capture 按时间顺序流式读回全部分段，用于离线分析：
+
+    python -m server.capture_sink user_data/capture --type cookie_change --since 1700000000
+"""
+
+import argparse
+import glob
+import gzip
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_PATTERN = "capture-*.jsonl.gz"
+_STOP = object()
+
+
+class CaptureSink:
+    def __init__(self, directory: str, segment_bytes: int = 16 * 1024 * 1024, segment_seconds: float = 3600,
+                 max_segments: int = 48, queue_size: int = 10000, batch_size: int = 500, flush_interval: float = 1):
+        self.directory = directory
+        self.segment_bytes = segment_bytes  # 分段压缩后的大小上限
+        self.segment_seconds = segment_seconds  # 分段最长时长（秒）
+        self.max_segments = max_segments  # 保留的分段数，0 表示不清理
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval  # 批量写入后最长多久刷到磁盘
+        self.stats = {"written": 0, "dropped": 0, "batches": 0, "segments": 0, "write_errors": 0}
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._seq = 0
+        self._raw = None
+        self._gzip = None
+        self._segment_path = None
+        self._segment_started = 0
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="capture-sink", daemon=True)
+        self._thread.start()
+
+    # ------------------ 对外接口 ------------------
+
+    def write(self, event: dict) -> bool:
+        """放入写队列，不做任何序列化和IO；队列已满时丢弃并计数。"""
+        try:
+            self._queue.put_nowait(event)
+            return True
+        except queue.Full:
+            self.stats["dropped"] += 1
+            return False
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def close(self, timeout: float = 5):
+        """写完队列中剩余的事件后关闭当前分段。"""
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            logger.warning("[采集] 写队列已满，关闭时丢弃剩余事件")
+        self._thread.join(timeout)
+
+    # ------------------ 写线程 ------------------
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                self._rotate_if_due()
+                continue
+            batch = []
+            item = first
+            while True:
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                self._write_batch(batch)
+        self._close_segment()
+
+    def _write_batch(self, batch: list):
+        try:
+            self._rotate_if_due()
+            if self._gzip is None:
+                self._open_segment()
+            data = "".join(json.dumps(event, ensure_ascii=False, default=str) + "\n" for event in batch)
+            self._gzip.write(data.encode("utf-8"))
+            # 同步刷新压缩流：进程异常退出时已写入的批次仍可读出
+            self._gzip.flush(zlib.Z_SYNC_FLUSH)
+            self.stats["written"] += len(batch)
+            self.stats["batches"] += 1
+        except Exception as e:
+            self.stats["write_errors"] += 1
+            self.stats["dropped"] += len(batch)
+            logger.error("[采集] 写入分段失败，丢弃 %s 条: %s", len(batch), e)
+            self._close_segment()
+
+    def _rotate_if_due(self):
+        if self._gzip is None:
+            return
+        if self._raw.tell() >= self.segment_bytes or time.time() - self._segment_started >= self.segment_seconds:
+            self._close_segment()
+
+    def _open_segment(self):
+        self._seq += 1
+        name = "capture-%s-%04d.jsonl.gz" % (time.strftime("%Y%m%d-%H%M%S"), self._seq % 10000)
+        self._segment_path = os.path.join(self.directory, name)
+        self._raw = open(self._segment_path, "ab")
+        self._gzip = gzip.GzipFile(fileobj=self._raw, mode="ab")
+        self._segment_started = time.time()
+        self.stats["segments"] += 1
+        self._prune()
+
+    def _close_segment(self):
+        if self._gzip is None:
+            return
+        try:
+            self._gzip.close()
+            self._raw.close()
+        except Exception as e:
+            logger.warning("[采集] 关闭分段失败: %s", e)
+        self._gzip = self._raw = None
+
+    def _prune(self):
+        if self.max_segments <= 0:
+            return
+        for path in list_segments(self.directory)[:-self.max_segments]:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning("[采集] 删除旧分段失败: %s", e)
+
+
+def list_segments(directory: str) -> list:
+    """按写入顺序返回分段文件（文件名以时间和序号开头，按名称排序即可）。"""
+    return sorted(glob.glob(os.path.join(directory, SEGMENT_PATTERN)))
+
+
+def read_capture(directory: str, since: float = None, types=None):
+    """
+    按时间顺序逐条读出分段中的事件，不把整个分段载入内存。
+    since 只返回 ts 不早于该时间的事件，types 只返回这些类型；正在写入或异常截断的分段读到末尾为止。
+    """
+    types = set(types) if types else None
+    for path in list_segments(directory):
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    event = json.loads(line)
+                    if types is not None and event.get("type") not in types:
+                        continue
+                    if since is not None and event.get("ts", 0) < since:
+                        continue
+                    yield event
+        except (EOFError, gzip.BadGzipFile, zlib.error, json.JSONDecodeError):
+            # 未关闭的分段没有结尾标记，已刷新的内容已全部读出
+            continue
+
+
+_sink = None
+
+def get_capture_sink():
+    """返回全局采集写入器，未启用时为 None。"""
+    return _sink
+
+def start_capture_sink(config: dict, default_dir: str) -> CaptureSink:
+    global _sink
+    directory = config.get("capture_dir") or os.path.join(default_dir, "capture")
+    _sink = CaptureSink(
+        directory,
+        segment_bytes=config.get("capture_segment_bytes", 16 * 1024 * 1024),
+        segment_seconds=config.get("capture_segment_seconds", 3600),
+        max_segments=config.get("capture_max_segments", 48),
+        queue_size=config.get("capture_queue_size", 10000),
+    )
+    logger.info("[采集] 监控请求写入 %s", os.path.abspath(directory))
+    return _sink
+
+def stop_capture_sink():
+    global _sink
+    if _sink is not None:
+        _sink.close()
+        _sink = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="读出采集分段，每行输出一个 JSON 事件")
+    parser.add_argument("directory")
+    parser.add_argument("--type", action="append", dest="types", help="只输出该类型的事件，可重复")
+    parser.add_argument("--since", type=float, help="只输出该时间戳（秒）之后的事件")
+    args = parser.parse_args(argv)
+    for event in read_capture(args.directory, since=args.since, types=args.types):
+        sys.stdout.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
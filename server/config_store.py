@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+sites.json 内存配置仓库：只在文件变化时重新解析，按 user_id / (user_id, code) / 媒体code 建索引
+"""
+
+import copy
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigStore:
+    def __init__(self, path: str, check_interval: float = 1.0):
+        self.path = path
+        self.check_interval = check_interval  # 两次检查文件 mtime 的最小间隔（秒）
+        self.version = 0  # 每次重建索引递增
+        self._lock = threading.RLock()
+        self._data = {}
+        self._mtime = None
+        self._hash = None
+        self._checked_at = 0.0
+        self._users = {}  # user_id -> user
+        self._sites = {}  # (user_id, code) -> site
+        self._media = {}  # str(code) -> media
+
+    def _build_indexes(self, data: dict):
+        """根据完整配置重建索引，重复条目保留第一个（与原先 next(...) 语义一致）。"""
+        users = {}
+        sites = {}
+        for user in data.get("users", []):
+            user_id = user.get("user_id")
+            users.setdefault(user_id, user)
+            for site in user.get("sites", []):
+                sites.setdefault((user_id, site.get("code")), site)
+        media = {str(code): item for code, item in data.get("config", {}).get("media_codes", {}).items()}
+        self._data = data
+        self._users = users
+        self._sites = sites
+        self._media = media
+        self.version += 1
+
+    def _read_file(self):
+        """读取文件，内容 hash 未变化时不重新解析 JSON。"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            if self._mtime is not None or not self.version:
+                self._mtime = None
+                self._hash = None
+                self._build_indexes({})
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                raw = f.read()
+            digest = hashlib.sha1(raw).hexdigest()
+            if digest != self._hash:
+                data = json.loads(raw.decode('utf-8'))
+                self._build_indexes(data if isinstance(data, dict) else {})
+                self._hash = digest
+            self._mtime = mtime
+        except Exception as e:
+            logger.error("Error loading %s: %s", self.path, e)
+            if not self.version:
+                self._build_indexes({})
+
+    def _ensure_fresh(self):
+        """距上次检查超过 check_interval 时才 stat 文件，其余调用只是字典查找。"""
+        now = time.monotonic()
+        if self.version and now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if self.version and now - self._checked_at < self.check_interval:
+                return
+            self._read_file()
+            self._checked_at = now
+
+    def reload(self):
+        """强制下次访问时重新检查文件。"""
+        with self._lock:
+            self._checked_at = 0.0
+            self._mtime = None
+
+    def data(self) -> dict:
+        """返回缓存的完整配置（只读，修改请使用 load/save）。"""
+        self._ensure_fresh()
+        return self._data
+
+    def load(self) -> dict:
+        """返回完整配置的副本，可自由修改后交给 save 写回。"""
+        self._ensure_fresh()
+        return copy.deepcopy(self._data)
+
+    def save(self, data: dict):
+        """写回 sites.json 并直接用新数据重建索引。"""
+        raw = json.dumps(data, indent=4, ensure_ascii=False).encode('utf-8')
+        with self._lock:
+            with open(self.path, 'wb') as f:
+                f.write(raw)
+            self._build_indexes(copy.deepcopy(data))
+            self._hash = hashlib.sha1(raw).hexdigest()
+            self._mtime = os.stat(self.path).st_mtime_ns
+            self._checked_at = time.monotonic()
+
+    def get_user(self, user_id):
+        self._ensure_fresh()
+        return self._users.get(user_id)
+
+    def get_site(self, user_id, code):
+        self._ensure_fresh()
+        return self._sites.get((user_id, code))
+
+    def get_media(self, code):
+        self._ensure_fresh()
+        return self._media.get(str(code))
+
+    def get_config(self) -> dict:
+        self._ensure_fresh()
+        return self._data.get("config", {})
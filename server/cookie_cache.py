@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Cookie 变化检测：按 (user_id, site_code) 记录已投递 cookie 的指纹，未变化且未超过 max_age 时不再重复投递，
+同一 key 正在投递时只保留最新一份待发送的 cookie
+"""
+
+import asyncio
+import hashlib
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+
+def parse_cookie_header(header: str) -> Dict[str, str]:
+    """解析请求头中的 cookie 字符串，如 'a=1; b=2' -> {'a': '1', 'b': '2'}。"""
+    cookies = {}
+    for part in header.split(";"):
+        name, sep, value = part.strip().partition("=")
+        if sep and name:
+            cookies[name] = value
+    return cookies
+
+def cookie_fingerprint(cookies: Dict[str, str]) -> str:
+    """与顺序无关的 cookie 指纹。"""
+    raw = "\x00".join(f"{k}={v}" for k, v in sorted(cookies.items()))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class _Entry:
+    __slots__ = ("fingerprint", "sent_at", "task", "pending")
+
+    def __init__(self):
+        self.fingerprint = None  # 最近一次投递成功的指纹
+        self.sent_at = 0.0
+        self.task = None  # 正在进行的投递任务
+        self.pending = None  # 投递中到达的最新 (fingerprint, cookie)
+
+
+class CookieChangeCache:
+    def __init__(self, max_age: float = 600):
+        self.max_age = max_age
+        self._entries: Dict[tuple, _Entry] = {}
+        self.stats = {"submitted": 0, "unchanged": 0, "coalesced": 0, "delivered": 0}
+
+    def submit(self, key: tuple, cookie: str, send: Callable[[str], Awaitable[bool]], max_age: Optional[float] = None):
+        """
+        提交一次捕获到的 cookie，需要投递时返回投递任务，否则返回 None。
+        调用方应在自己的任务中等待返回的任务，投递（含重试退避）才会计入所在任务组的并发上限，并随任务组一起取消。
+        """
+        self.stats["submitted"] += 1
+        fingerprint = cookie_fingerprint(parse_cookie_header(cookie))
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = _Entry()
+
+        if entry.task is not None:
+            entry.pending = (fingerprint, cookie)
+            self.stats["coalesced"] += 1
+            return None
+
+        max_age = self.max_age if max_age is None else max_age
+        if entry.fingerprint == fingerprint and time.monotonic() - entry.sent_at < max_age:
+            self.stats["unchanged"] += 1
+            return None
+
+        task = entry.task = asyncio.create_task(
+            self._deliver(entry, fingerprint, cookie, send), name="cookie-send:" + ":".join(map(str, key)))
+        # 在完成回调中清除，任务在开始执行前就被取消时也不会一直占着投递标记
+        task.add_done_callback(lambda done: self._on_done(entry, done))
+        return task
+
+    async def _deliver(self, entry: _Entry, fingerprint: str, cookie: str, send):
+        while True:
+            if await send(cookie):
+                entry.fingerprint = fingerprint
+                entry.sent_at = time.monotonic()
+                self.stats["delivered"] += 1
+            pending, entry.pending = entry.pending, None
+            if pending is None or pending[0] == entry.fingerprint:
+                break
+            fingerprint, cookie = pending
+
+    @staticmethod
+    def _on_done(entry: _Entry, task: asyncio.Task):
+        if entry.task is task:
+            entry.task = None
+            if task.cancelled():
+                entry.pending = None
+
+    def forget(self, key: tuple):
+        """监控停止时清除该 key 的记录并取消进行中的投递，下次启动会重新投递。"""
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry.task is not None:
+            entry.task.cancel()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+cookie_api 异步投递客户端：长连接池 + 并发上限 + 超时 + 退避重试，阻塞的网络IO放到线程池执行，不占用事件循环
+"""
+
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from server import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class CookieSender:
+    def __init__(self, max_concurrency: int = 16, timeout: float = 10, retries: int = 3, backoff: float = 0.5):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.retries = retries  # 失败后的最大重试次数
+        self.backoff = backoff  # 首次重试等待秒数，之后按2倍递增
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_concurrency, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="cookie-sender")
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+
+    def _post(self, url: str, payload):
+        return self.session.post(url, json=payload, timeout=self.timeout)
+
+    async def post(self, url: str, payload):
+        """POST JSON，5xx 或网络异常时退避重试，最终失败返回 None。"""
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.semaphore:
+                    response = await loop.run_in_executor(self.executor, self._post, url, payload)
+                if response.status_code < 500:
+                    metrics.cookie_send_seconds.observe(time.perf_counter() - started, str(response.status_code))
+                    return response
+                error = f"HTTP {response.status_code}"
+            except Exception as e:
+                error = e
+            if attempt < self.retries:
+                delay = self.backoff * (2 ** attempt)
+                logger.warning("[警告] 发送Cookie失败，%.1f秒后重试(%s/%s): %s", delay, attempt + 1, self.retries, error)
+                await asyncio.sleep(delay)
+        logger.error("[错误] 发送Cookie失败，已放弃: %s %s", url, error)
+        metrics.cookie_send_seconds.observe(time.perf_counter() - started, "error")
+        return None
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+
+_sender = None
+
+def get_cookie_sender() -> CookieSender:
+    """获取全局投递客户端，首次调用时按 sites.json 的 config 创建。"""
+    global _sender
+    if _sender is None:
+        from server.app import get_config_item
+        config = get_config_item("config")
+        _sender = CookieSender(
+            max_concurrency=config.get("cookie_send_concurrency", 16),
+            timeout=config.get("cookie_send_timeout", 10),
+            retries=config.get("cookie_send_retries", 3),
+            backoff=config.get("cookie_send_backoff", 0.5),
+        )
+    return _sender
+
+def close_cookie_sender():
+    """关闭全局投递客户端，释放连接池和线程池。"""
+    global _sender
+    if _sender is not None:
+        _sender.close()
+        _sender = None
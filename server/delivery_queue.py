@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Cookie 投递的本地持久化队列（SQLite）：捕获的 cookie 先落盘再投递，按大小/时间窗口批量发送，
+同一 key 严格按入队顺序投递，cookie_api 不可用时保留在队列中，重启后继续投递
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+
+logger = logging.getLogger(__name__)
+
+
+class DeliveryQueue:
+    def __init__(self, path: str, batch_size: int = 50, batch_window: float = 0.5, batch_api: str = None,
+                 retry_delay: float = 1, max_retry_delay: float = 60):
+        self.path = path
+        self.batch_size = batch_size
+        self.batch_window = batch_window  # 凑批最长等待时间（秒）
+        self.batch_api = batch_api  # 配置后整批作为一个 JSON 数组 POST 到该地址
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.stats = {"enqueued": 0, "delivered": 0, "batches": 0, "failed_attempts": 0}
+        # 所有 SQLite 操作都在同一个线程中执行，不阻塞事件循环
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="delivery-queue")
+        self._conn = None
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    # ------------------ SQLite（仅在队列线程中调用） ------------------
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS outbox ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL, payload TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _insert(self, key: str, payload: str):
+        db = self._db()
+        db.execute("INSERT INTO outbox (key, payload, created_at) VALUES (?, ?, ?)", (key, payload, time.time()))
+        db.commit()
+
+    def _fetch(self, limit: int) -> list:
+        return self._db().execute("SELECT id, key, payload, created_at FROM outbox ORDER BY id LIMIT ?", (limit,)).fetchall()
+
+    def _delete(self, ids: list):
+        db = self._db()
+        db.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in ids])
+        db.commit()
+
+    def _count(self) -> int:
+        return self._db().execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def _close_db(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def _call(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    # ------------------ 对外接口 ------------------
+
+    async def enqueue(self, key: str, payload: dict):
+        """写入队列（落盘后返回），唤醒投递循环。"""
+        await self._call(self._insert, key, json.dumps(payload, ensure_ascii=False))
+        self.stats["enqueued"] += 1
+        self._wakeup.set()
+
+    async def pending(self) -> int:
+        return await self._call(self._count)
+
+    def start(self, send):
+        """启动投递循环，send(url, payload) 为异步发送函数，返回 response 或 None。"""
+        self._task = asyncio.create_task(self._run(send), name="delivery-queue")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self._call(self._close_db)
+        self._executor.shutdown(wait=False)
+
+    # ------------------ 投递循环 ------------------
+
+    async def _run(self, send):
+        delay = self.retry_delay
+        while True:
+            try:
+                rows = await self._call(self._fetch, self.batch_size)
+                if not rows:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                # 未凑满一批时，等到最早一条满 batch_window 再发
+                wait = rows[0][3] + self.batch_window - time.time()
+                if len(rows) < self.batch_size and wait > 0:
+                    await asyncio.sleep(wait)
+                    rows = await self._call(self._fetch, self.batch_size)
+
+                delivered, ok = await self._deliver(rows, send)
+                if delivered:
+                    await self._call(self._delete, delivered)
+                    self.stats["delivered"] += len(delivered)
+                self.stats["batches"] += 1
+                if ok:
+                    delay = self.retry_delay
+                else:
+                    self.stats["failed_attempts"] += 1
+                    logger.warning("[投递队列] 部分投递失败，%s秒后重试，剩余 %s 条", delay, len(rows) - len(delivered))
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.max_retry_delay)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception("[异常] 投递队列异常: %s", e)
+                await asyncio.sleep(delay)
+
+    async def _deliver(self, rows, send):
+        """返回 (已成功投递的 id 列表, 是否全部成功)。"""
+        if self.batch_api:
+            response = await send(self.batch_api, [json.loads(row[2]) for row in rows])
+            if response is not None and response.ok:
+                return [row[0] for row in rows], True
+            return [], False
+
+        from server.app import get_config_item
+        cookie_api = get_config_item("config")["cookie_api"]
+
+        async def deliver_key(key_rows):
+            # 同一 key 顺序投递，失败即停止，保证后面的更新不会先于前面的到达
+            done = []
+            for row_id, _, payload, _ in key_rows:
+                url = f"{cookie_api}?t={int(time.time() * 1000000000)}"
+                response = await send(url, json.loads(payload))
+                if response is None or response.status_code >= 500:
+                    break
+                if not response.ok:
+                    # 4xx 重试也不会成功，记录后丢弃，避免阻塞该 key 的后续更新
+                    logger.warning("[投递队列] cookie_api 拒绝投递，已丢弃: key=%s %s %s", key_rows[0][1], response.status_code, response.text)
+                done.append(row_id)
+            return done
+
+        by_key = {}
+        for key, key_rows in groupby(sorted(rows, key=lambda r: (r[1], r[0])), key=lambda r: r[1]):
+            by_key[key] = list(key_rows)
+        results = await asyncio.gather(*(deliver_key(key_rows) for key_rows in by_key.values()))
+        delivered = [row_id for done in results for row_id in done]
+        return delivered, len(delivered) == len(rows)
+
+
+_queue = None
+
+def get_delivery_queue():
+    """返回全局投递队列，未启用时为 None。"""
+    return _queue
+
+async def start_delivery_queue(path: str, config: dict) -> DeliveryQueue:
+    global _queue
+    from server.cookie_sender import get_cookie_sender
+    _queue = DeliveryQueue(
+        path,
+        batch_size=config.get("cookie_batch_size", 50),
+        batch_window=config.get("cookie_batch_window", 0.5),
+        batch_api=config.get("cookie_batch_api"),
+    )
+    pending = await _queue.pending()
+    if pending:
+        logger.info("[投递队列] 重启后继续投递 %s 条积压的Cookie", pending)
+    _queue.start(get_cookie_sender().post)
+    return _queue
+
+async def stop_delivery_queue():
+    global _queue
+    if _queue is not None:
+        await _queue.stop()
+        _queue = None
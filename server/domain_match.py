@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+媒体域名匹配：每个媒体按 url 的主域名和 domains 编译一棵反向标签字典树，
+判断请求 host 是否属于该媒体只需按标签逐级查找一次，结果按 host 缓存
+"""
+
+import ipaddress
+from functools import lru_cache
+from urllib.parse import urlparse
+
+# 内置的公共后缀表（Public Suffix List 中常用的多级后缀），单级顶级域名默认都是公共后缀
+PUBLIC_SUFFIXES = frozenset((
+    "com.cn", "net.cn", "org.cn", "gov.cn", "edu.cn", "ac.cn", "mil.cn",
+    "bj.cn", "sh.cn", "tj.cn", "cq.cn", "gd.cn", "zj.cn", "js.cn", "sz.cn",
+    "com.hk", "net.hk", "org.hk", "edu.hk", "gov.hk",
+    "com.tw", "net.tw", "org.tw", "edu.tw", "gov.tw",
+    "com.mo", "net.mo", "org.mo",
+    "co.uk", "org.uk", "ac.uk", "gov.uk", "ltd.uk", "plc.uk", "me.uk",
+    "co.jp", "ne.jp", "or.jp", "ac.jp", "go.jp",
+    "co.kr", "or.kr", "ne.kr", "go.kr",
+    "com.au", "net.au", "org.au", "edu.au", "gov.au",
+    "com.sg", "net.sg", "org.sg", "edu.sg", "gov.sg",
+    "com.my", "net.my", "org.my",
+    "co.th", "in.th", "or.th",
+    "com.vn", "net.vn", "org.vn",
+    "co.id", "or.id", "web.id",
+    "com.ph", "net.ph", "org.ph",
+    "co.in", "net.in", "org.in", "firm.in",
+    "com.br", "net.br", "org.br",
+    "com.mx", "org.mx",
+    "co.nz", "net.nz", "org.nz",
+    "com.tr", "net.tr", "org.tr",
+    "com.ru", "net.ru", "org.ru",
+    "co.za", "org.za",
+))
+
+
+def _build_suffix_trie(suffixes) -> dict:
+    trie = {}
+    for suffix in suffixes:
+        node = trie
+        for label in reversed(suffix.split(".")):
+            node = node.setdefault(label, {})
+        node[""] = True  # 结束标记
+    return trie
+
+
+_SUFFIX_TRIE = _build_suffix_trie(PUBLIC_SUFFIXES)
+
+
+def _is_ip(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host.strip("[]"))
+        return True
+    except ValueError:
+        return False
+
+
+@lru_cache(maxsize=4096)
+def registrable_domain(host: str) -> str:
+    """
+    返回 host 的可注册主域名（公共后缀再加一级），如 www.example.com.cn -> example.com.cn。
+    IP、单级主机名（localhost）和公共后缀本身原样返回。
+    """
+    host = (host or "").strip().lower().rstrip(".")
+    if not host or _is_ip(host):
+        return host
+    labels = host.split(".")
+    if len(labels) < 2:
+        return host
+    # 沿反向标签查找最长的公共后缀，找不到多级后缀时顶级域名即为后缀
+    suffix_len, node = 1, _SUFFIX_TRIE
+    for depth, label in enumerate(reversed(labels), 1):
+        node = node.get(label)
+        if node is None:
+            break
+        if "" in node:
+            suffix_len = depth
+    if suffix_len >= len(labels):
+        return host
+    return ".".join(labels[-suffix_len - 1:])
+
+
+class DomainMatcher:
+    """
+    反向标签字典树：example.com 存为 com -> example，host 从顶级域名开始逐级查找，
+    途中遇到结束标记即命中（本域名及其子域名）。
+    """
+
+    def __init__(self, domains, cache_size: int = 1024):
+        self.domains = tuple(sorted({d.strip().lower().strip(".") for d in domains if d and d.strip(". ")}))
+        self._trie = {}
+        for domain in self.domains:
+            node = self._trie
+            for label in reversed(domain.split(".")):
+                node = node.setdefault(label, {})
+            node[""] = True
+        self.match = lru_cache(maxsize=cache_size)(self._match)
+
+    def _match(self, host: str) -> bool:
+        if not host:
+            return False
+        node = self._trie
+        for label in reversed(host.lower().rstrip(".").split(".")):
+            node = node.get(label)
+            if node is None:
+                return False
+            if "" in node:
+                return True
+        return False
+
+    def match_url(self, url: str) -> bool:
+        return self.match(url_host(url))
+
+
+def url_host(url: str) -> str:
+    """从请求url中截取host（小写、去掉用户信息和端口），比 urlparse 轻量，供每个请求调用。"""
+    start = url.find("://")
+    start = start + 3 if start >= 0 else 0
+    end = len(url)
+    for sep in "/?#":
+        pos = url.find(sep, start, end)
+        if pos >= 0:
+            end = pos
+    netloc = url[start:end]
+    netloc = netloc[netloc.rfind("@") + 1:]
+    if netloc.startswith("["):
+        return netloc[1:netloc.find("]")].lower()
+    return netloc.partition(":")[0].lower()
+
+
+def media_domains(url: str, domains=None) -> list:
+    """媒体的全部匹配域名：url 的主域名加上配置的 domains。"""
+    return [registrable_domain(urlparse(url).hostname)] + list(domains or [])
+
+
+@lru_cache(maxsize=256)
+def _compile(url: str, domains: tuple) -> DomainMatcher:
+    return DomainMatcher(media_domains(url, domains))
+
+
+def get_matcher(url: str, domains=None) -> DomainMatcher:
+    """按 (url, domains) 取编译好的匹配器，媒体配置不变时始终复用同一个。"""
+    return _compile(url, tuple(domains or ()))
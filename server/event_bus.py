@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+实时事件分发：cookie 变化和监控状态事件推送给 SSE 订阅者，每个订阅者一个有界队列，
+消费过慢时同一 key 的事件合并为最新一条，无法合并时丢弃最旧的事件
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+class Subscriber:
+    def __init__(self, max_queue: int = 100, user_ids=None, site_codes=None, media_codes=None, types=None):
+        self.max_queue = max_queue
+        # 筛选条件，None 表示不限制；统一按字符串比较
+        self.user_ids = {str(v) for v in user_ids} if user_ids else None
+        self.site_codes = {str(v) for v in site_codes} if site_codes else None
+        self.media_codes = {str(v) for v in media_codes} if media_codes else None
+        self.types = set(types) if types else None
+        self.pending = OrderedDict()  # 合并key -> 事件，按到达顺序
+        self.merged = 0
+        self.dropped = 0
+        self._wakeup = asyncio.Event()
+
+    def matches(self, event: dict) -> bool:
+        if self.types is not None and event["type"] not in self.types:
+            return False
+        if self.user_ids is not None and str(event.get("user_id")) not in self.user_ids:
+            return False
+        if self.site_codes is not None and str(event.get("site_code")) not in self.site_codes:
+            return False
+        if self.media_codes is not None and str(event.get("media_code")) not in self.media_codes:
+            return False
+        return True
+
+    def put(self, event: dict):
+        key = (event["type"], event.get("user_id"), event.get("site_code"))
+        if key in self.pending:
+            # 还未被消费的同 key 事件直接替换为最新一条
+            del self.pending[key]
+            self.merged += 1
+        elif len(self.pending) >= self.max_queue:
+            self.pending.popitem(last=False)
+            self.dropped += 1
+        self.pending[key] = event
+        self._wakeup.set()
+
+    async def get(self, timeout: float) -> Optional[dict]:
+        """取出最早的一条事件，超时返回 None。"""
+        if not self.pending:
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        return self.pending.popitem(last=False)[1]
+
+
+class EventBus:
+    def __init__(self):
+        self.subscribers = set()
+        self.published = 0
+
+    def subscribe(self, **kwargs) -> Subscriber:
+        subscriber = Subscriber(**kwargs)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+
+    def publish(self, event_type: str, **fields):
+        """发布事件；没有订阅者时几乎没有开销。"""
+        if not self.subscribers:
+            return
+        event = {"type": event_type, "ts": time.time(), **fields}
+        self.published += 1
+        for subscriber in list(self.subscribers):
+            if subscriber.matches(event):
+                subscriber.put(event)
+
+
+event_bus = EventBus()
+
+def publish_cookie_change(user_id, site_code, cookie: str, account_type=None):
+    event_bus.publish("cookie_change", user_id=str(user_id), site_code=str(site_code), media_code=str(site_code),
+                      cookies=cookie, account_type=account_type)
+
+def publish_monitor_state(task_key: str, state: str, reason: str = None):
+    user_id, site_code, url = task_key.split(":", 2)
+    event_bus.publish("monitor_state", user_id=user_id, site_code=site_code, media_code=site_code,
+                      url=url, state=state, reason=reason)
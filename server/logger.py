@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+异步结构化日志：调用方只把日志记录放入队列，格式化、脱敏和写控制台/文件都在后台线程完成；
+同一条日志模板在时间窗口内超过上限时丢弃并汇总，cookie 值在输出前脱敏
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import re
+import sys
+
+# cookies / cookie / set-cookie 后面的值，只保留名称，值替换为 ***；
+# 名称前只能是行首、空白、引号或括号/逗号（请求头、JSON、dict），"发射Cookie: user_id=..." 这类普通文字不会被当作 cookie
+COOKIE_VALUE_PATTERN = re.compile(
+    r"""((?<![^\s"'{(\[,])(?:set-)?cookies?["']?\s*[:=]\s*["']?)([^"'\n}]+)""", re.IGNORECASE)
+COOKIE_PAIR_PATTERN = re.compile(r"=[^;]*")
+# 作为 extra 传入时需要脱敏的字段
+SENSITIVE_FIELDS = ("cookie", "cookies")
+# LogRecord 自带的属性，其余的视为通过 extra 传入的结构化字段
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+_listener = None
+
+
+def redact_cookie(value: str) -> str:
+    """a=1; b=2 -> a=***; b=***"""
+    return COOKIE_PAIR_PATTERN.sub("=***", str(value))
+
+
+def redact(text: str) -> str:
+    return COOKIE_VALUE_PATTERN.sub(lambda m: m.group(1) + redact_cookie(m.group(2)), text)
+
+
+def _extra_fields(record: logging.LogRecord) -> dict:
+    fields = {}
+    for key, value in vars(record).items():
+        if key not in _RECORD_ATTRS and not key.startswith("_"):
+            fields[key] = redact_cookie(value) if key in SENSITIVE_FIELDS else value
+    return fields
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self, redact_cookies: bool = True):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+        self.redact_cookies = redact_cookies
+
+    def format(self, record):
+        text = super().format(record)
+        fields = _extra_fields(record)
+        if fields:
+            text += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        return redact(text) if self.redact_cookies else text
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志一行 JSON：ts / level / logger / msg，extra 传入的字段原样合并。"""
+
+    def __init__(self, redact_cookies: bool = True):
+        super().__init__()
+        self.redact_cookies = redact_cookies
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(_extra_fields(record))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        text = json.dumps(entry, ensure_ascii=False, default=str)
+        return redact(text) if self.redact_cookies else text
+
+
+class RateLimitFilter(logging.Filter):
+    """同一 (logger, 级别, 模板) 每个窗口最多放行 limit 条，窗口结束后补一条被丢弃的数量。"""
+
+    def __init__(self, limit: int = 20, window: float = 10):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.counts = {}  # key -> [窗口开始时间, 本窗口条数]
+        self.suppressed = 0
+
+    def filter(self, record):
+        if self.limit <= 0 or record.levelno >= logging.ERROR:
+            return True
+        key = (record.name, record.levelno, record.msg)
+        now = record.created
+        entry = self.counts.get(key)
+        if entry is None or now - entry[0] >= self.window:
+            dropped = entry[1] - self.limit if entry and entry[1] > self.limit else 0
+            self.counts[key] = [now, 1]
+            if dropped:
+                record.suppressed = dropped
+            if len(self.counts) > 10000:
+                # 模板数量正常很少，超出时直接清空，避免无限增长
+                self.counts.clear()
+            return True
+        entry[1] += 1
+        if entry[1] > self.limit:
+            self.suppressed += 1
+            return False
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # 不在调用方格式化，格式化和脱敏都交给后台线程
+        return record
+
+
+def setup_logging(config: dict = None):
+    """
+    按 config 配置根日志：log_level、log_format(text/json)、log_file、
+    log_rate_limit / log_rate_window、log_redact_cookies。可重复调用，后一次覆盖前一次。
+    """
+    global _listener
+    config = config or {}
+    shutdown_logging()
+
+    redact_cookies = config.get("log_redact_cookies", True)
+    formatter = JsonFormatter(redact_cookies) if config.get("log_format", "text") == "json" else TextFormatter(redact_cookies)
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if config.get("log_file"):
+        handlers.append(logging.handlers.RotatingFileHandler(
+            config["log_file"], maxBytes=config.get("log_file_max_bytes", 10 * 1024 * 1024),
+            backupCount=config.get("log_file_backups", 5), encoding="utf-8"))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(config.get("log_rate_limit", 20), config.get("log_rate_window", 10)))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, _QueueHandler):
+            root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(config.get("log_level", "INFO").upper())
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    """停止后台写线程，写完队列中剩余的日志。"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
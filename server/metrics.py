@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+轻量指标采集：计数器 / 直方图 / 采集时计算的仪表盘，以 Prometheus 文本格式输出。
+热路径上每次记录只是一次字典查找和加法，不加锁（只在事件循环线程中调用）
+"""
+
+import asyncio
+import bisect
+import time
+from typing import Callable, Dict, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    parts = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.values: Dict[Tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_values, value in self.values.items():
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.series: Dict[Tuple, list] = {}  # label_values -> [每个桶的计数..., +Inf计数, 总和]
+
+    def observe(self, value: float, *label_values):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [0] * (len(self.buckets) + 2)
+        # 只记录落入的那个桶，输出时再累加
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def time(self, *label_values):
+        return _Timer(self, label_values)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_values, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, label_values, le)} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {series[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "label_values", "start")
+
+    def __init__(self, histogram: Histogram, label_values: Tuple):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+
+
+class Gauge:
+    """采集时调用 func 取值；func 返回数值，或 {label_values: 数值}。"""
+
+    def __init__(self, name: str, help_text: str, func: Callable, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.func = func
+        self.labels = labels
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            value = self.func()
+        except Exception:
+            return lines
+        if isinstance(value, dict):
+            for label_values, v in value.items():
+                lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {v}")
+        else:
+            lines.append(f"{self.name} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, help_text, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labels: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help_text: str, func: Callable, labels: Tuple[str, ...] = ()) -> Gauge:
+        metric = Gauge(name, help_text, func, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# ------------------ 热路径指标 ------------------
+
+requests_seen = registry.counter(
+    "monitor_requests_seen_total", "Requests delivered to a monitor's handler", ("user_id", "site_code"))
+requests_filtered = registry.counter(
+    "monitor_requests_filtered_total", "Requests dropped by a monitor filter", ("user_id", "site_code", "stage"))
+cookie_send_seconds = registry.histogram(
+    "cookie_send_seconds", "Latency of cookie deliveries to cookie_api, including retries", ("status",))
+refresh_cycle_seconds = registry.histogram(
+    "refresh_cycle_seconds", "Duration of a page refresh scheduler cycle", buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300))
+page_operation_seconds = registry.histogram(
+    "page_operation_seconds", "Duration of browser launch, page.goto and page.reload", ("operation",), buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60))
+event_loop_lag_seconds = registry.histogram(
+    "event_loop_lag_seconds", "How late the event loop woke a sleeping probe", buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+
+
+async def monitor_event_loop_lag(interval: float = 0.5):
+    """周期性休眠，记录实际唤醒时间比预期晚了多少。"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        event_loop_lag_seconds.observe(max(0.0, loop.time() - start - interval))
+
+
+def install_app_gauges(app):
+    """注册采集时从 app.state 读取的仪表盘：存活的 context / 页面数、各状态的监控数。"""
+    def browser_manager():
+        return app.state.browser_manager
+
+    def monitor_states():
+        watchdog = getattr(app.state, "watchdog", None)
+        tasks = app.state.monitor_tasks
+        running = [key for key, task in tasks.items() if not task.done()]
+        degraded = sum(1 for key in running if watchdog and key in watchdog.health)
+        return {("running",): len(running) - degraded, ("degraded",): degraded}
+
+    registry.gauge("browser_contexts", "Live browser contexts", lambda: len(browser_manager().contexts))
+    registry.gauge("browser_pages", "Live pages", lambda: sum(1 for page in browser_manager().pages.values() if not page.is_closed()))
+    registry.gauge("monitors", "Monitor tasks by state", monitor_states, ("state",))
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+运行中监控任务的持久化登记表，进程重启或浏览器重启后据此自动恢复监控
+"""
+
+import asyncio
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class MonitorRegistry:
+    def __init__(self, path: str, save_delay: float = 0.5):
+        self.path = path
+        self.save_delay = save_delay  # 合并短时间内的多次变更，只写一次文件
+        self.entries = {}  # "user_id:site_code" -> {"user_id": ..., "site_code": ...}
+        self._save_handle = None
+        self._flush_task = None  # 延迟保存触发的写入任务，保持引用避免被回收
+        self._write_lock = asyncio.Lock()  # 延迟保存和关闭时的 flush 可能同时写同一个临时文件
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                items = json.load(f)
+            for item in items:
+                self.entries[f"{item['user_id']}:{item['site_code']}"] = item
+        except Exception as e:
+            logger.error("Error loading monitor registry %s: %s", self.path, e)
+
+    def items(self) -> list:
+        """返回 [(user_id, site_code), ...]。"""
+        return [(item["user_id"], item["site_code"]) for item in self.entries.values()]
+
+    def add(self, user_id, site_code):
+        key = f"{user_id}:{site_code}"
+        if key not in self.entries:
+            self.entries[key] = {"user_id": user_id, "site_code": site_code}
+            self._schedule_save()
+
+    def remove(self, user_id, site_code):
+        if self.entries.pop(f"{user_id}:{site_code}", None) is not None:
+            self._schedule_save()
+
+    def _schedule_save(self):
+        if self._save_handle is not None:
+            return
+        self._save_handle = asyncio.get_running_loop().call_later(self.save_delay, self._start_flush)
+
+    def _start_flush(self):
+        self._save_handle = None
+        self._flush_task = asyncio.create_task(self.flush(), name="monitor-registry-flush")
+        self._flush_task.add_done_callback(self._on_flush_done)
+
+    def _on_flush_done(self, task: asyncio.Task):
+        if self._flush_task is task:
+            self._flush_task = None
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Error saving monitor registry %s: %s", self.path, task.exception())
+
+    def _write(self, items: list):
+        """写临时文件后替换，避免写到一半崩溃导致登记表损坏。"""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(items, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    async def flush(self):
+        """立即把当前登记表写入文件（在线程中执行）。"""
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+            self._save_handle = None
+        try:
+            async with self._write_lock:
+                await asyncio.to_thread(self._write, list(self.entries.values()))
+        except Exception as e:
+            logger.error("Error saving monitor registry %s: %s", self.path, e)
@@ -4,124 +4,303 @@
 """
 
 import asyncio
+import logging
 from typing import Callable, Any
 from fastapi import HTTPException
 from urllib.parse import urlparse
-import requests
+import re
 import time
+from server.cookie_sender import get_cookie_sender
+from server.cookie_cache import CookieChangeCache
+from server.capture_buffer import RequestRingBuffer, DEFAULT_CAPTURE_FIELDS
+from server.event_bus import publish_cookie_change
+from server.delivery_queue import get_delivery_queue
+from server.task_supervisor import supervisor
+from server.domain_match import get_matcher, media_domains, registrable_domain, url_host
+from server.capture_sink import get_capture_sink
+from server.logger import redact_cookie
+from server import metrics
 
-async def monitor_fetch_requests(browser_manager, user_id: str, site_code: str, url: str, on_request: Callable[[dict], Any]=None, duration: int=60):
+logger = logging.getLogger(__name__)
+
+# 性能模式下拦截的资源类型，以及用于在浏览器端预筛选这些资源的URL正则
+BLOCKED_RESOURCE_TYPES = ("image", "media", "font")
+HEAVY_RESOURCE_PATTERN = re.compile(
+    r"\.(png|jpe?g|gif|webp|avif|bmp|ico|svg|woff2?|ttf|otf|eot|mp4|webm|m3u8|flv|mp3|m4a|ogg|wav)([?#]|$)",
+    re.IGNORECASE,
+)
+# route 模式下不拦截的静态资源（脚本、样式、图片、字体、音视频），这些请求不带需要的接口 cookie
+STATIC_RESOURCE_SUFFIX = (
+    r"[^?#]*\.(js|mjs|css|map|png|jpe?g|gif|webp|avif|bmp|ico|svg|woff2?|ttf|otf|eot|mp4|webm|m3u8|flv|mp3|m4a|ogg|wav)([?#]|$)"
+)
+
+# 已投递cookie的指纹缓存，按 (user_id, site_code) 去重
+cookie_cache = CookieChangeCache()
+
+async def monitor_fetch_requests(browser_manager, user_id: str, site_code: str, url: str, on_request: Callable[[dict], Any]=None, duration: int=60, buffer: RequestRingBuffer=None, site_codes: set=None):
     """
     监控指定用户和站点的Fetch/XHR请求，启动时自动跳转到url。
+    捕获的请求写入定长环形缓冲区 buffer，只保留最近的记录。
+    site_codes 为共用该页面的全部站点（可在运行中增减），捕获到的cookie对每个站点各投递一次，默认只有 site_code。
     """
     page = await browser_manager.get_page(user_id, site_code, url)
-    requests = []
+    if buffer is None:
+        buffer = create_capture_buffer()
 
-    def handle_request(request):
+    from server.app import get_config_item
+    config = get_config_item("config")
+    media_config = get_config_item("media", site_code) or {}
+    filter_mode = config.get("request_filter_mode", "listener")
+    # 媒体域名匹配器只编译一次，非媒体域名的请求不再创建投递任务
+    matcher = get_matcher(url, media_config.get("domains"))
+    # 启用采集时每个 Fetch/XHR 请求写一条落盘记录
+    sink = get_capture_sink()
+
+    def on_cookie_change():
+        # cookie 变化后延迟保存一次存储状态
+        browser_manager.schedule_storage_save(user_id, config.get("storage_save_delay", 5))
+
+    # 派生的cookie检查任务交给该监控的任务组，受全局并发上限和过载策略约束，停止监控时一并取消
+    group = supervisor.open_group(user_id, site_code, config)
+
+    def accept(request):
+        """筛选并采集请求，需要检查cookie时返回 (任务工厂, 合并key)。"""
+        metrics.requests_seen.inc(user_id, site_code)
         # 只监控Fetch/XHR请求
-        if request.resource_type in ("fetch", "xhr"):
-            info = {
-                "url": request.url,
-                "method": request.method,
-                "headers": dict(request.headers),
-                "post_data": request.post_data,
-                "resource_type": request.resource_type,
-                "timestamp": asyncio.get_event_loop().time()
-            }
-            requests.append(info)
-            asyncio.create_task(check_and_send_cookie(request, user_id, site_code, url))
-            if on_request:
-                on_request(info)
-
-    # 添加请求监听器
-    page.on("request", handle_request)
+        if request.resource_type not in ("fetch", "xhr"):
+            metrics.requests_filtered.inc(user_id, site_code, "resource_type")
+            return None
+        record = buffer.capture(request, asyncio.get_event_loop().time())
+        host = url_host(request.url)
+        matched = matcher.match(host)
+        if sink is not None:
+            sink.write({"type": "request", "ts": time.time(), "user_id": user_id, "site_code": site_code,
+                        "url": request.url, "method": request.method, "resource_type": request.resource_type,
+                        "media": matched})
+        if on_request:
+            on_request(record.to_dict(buffer.fields))
+        if not matched:
+            metrics.requests_filtered.inc(user_id, site_code, "domain")
+            return None
+        # 同一 host 的请求带的是同一份cookie，积压时只需检查最新的一个
+        return lambda: check_and_send_cookie(request, user_id, site_code, url, on_change=on_cookie_change, site_codes=site_codes, matcher=matcher), host
+
+    def handle_request(request):
+        job = accept(request)
+        if job:
+            group.submit(*job)
+
+    async def handle_route(route):
+        # 浏览器端已按媒体域名和路径筛选，这里只需再按资源类型筛选
+        if group.policy != "backpressure":
+            # 先放行请求再做采集和筛选，请求只多一次往返，不再等待 Python 端处理
+            await route.fallback()
+            job = accept(route.request)
+            if job:
+                group.submit(*job)
+            return
+        # backpressure 策略下请求在浏览器端等待空位
+        job = accept(route.request)
+        if job:
+            await group.submit_wait(*job)
+        await route.fallback()
+
+    blocked_types = set(config.get("blocked_resource_types", BLOCKED_RESOURCE_TYPES))
+
+    async def block_heavy(route):
+        if route.request.resource_type in blocked_types:
+            await route.abort()
+        else:
+            await route.fallback()
+
+    route_pattern = build_domain_pattern(url, media_config.get("domains"), media_config.get("api_paths"))
+
+    async def attach(page):
+        # 性能模式：直接拦截图片、媒体、字体等大体积资源
+        if config.get("performance_mode"):
+            await page.route(HEAVY_RESOURCE_PATTERN, block_heavy)
+        # 添加请求监听器；route 模式下由浏览器按URL筛选，只有媒体域名下的请求才会传到Python
+        if filter_mode == "route":
+            await page.route(route_pattern, handle_route)
+        else:
+            page.on("request", handle_request)
+
+    async def detach(page):
+        # 移除请求监听器，使用正确的 Playwright API
+        try:
+            # 在 Playwright 中，移除事件监听器的正确方式是使用 removeListener
+            if filter_mode == "route":
+                await page.unroute(route_pattern, handle_route)
+            else:
+                page.remove_listener("request", handle_request)
+            if config.get("performance_mode"):
+                await page.unroute(HEAVY_RESOURCE_PATTERN, block_heavy)
+        except Exception as e:
+            # 忽略可能的错误，确保不影响主流程
+            logger.warning("[警告] 移除请求监听器失败：%s", e)
+
+    check_interval = config.get("page_check_interval", 5)
+    deadline = asyncio.get_event_loop().time() + duration
 
     try:
-        await asyncio.sleep(duration)
+        await attach(page)
+        # 定期检查页面是否被回收/淘汰，若已替换则把监听器迁移到新页面
+        while True:
+            remaining = deadline - asyncio.get_event_loop().time()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(min(remaining, check_interval))
+            current = browser_manager.current_page(user_id, site_code)
+            if current is page and not page.is_closed():
+                continue
+            try:
+                await detach(page)
+                if current is None or current.is_closed():
+                    current = await browser_manager.get_page(user_id, site_code, url)
+                page = current
+                await attach(page)
+                logger.info("[信息] 监控页面已更换，重新挂载监听器: user_id=%s, site_code=%s", user_id, site_code)
+            except Exception as e:
+                # 浏览器可能正在重建，下次检查时重试
+                logger.warning("[警告] 重新挂载监听器失败，稍后重试: user_id=%s, site_code=%s, 错误: %s", user_id, site_code, e)
     except asyncio.CancelledError:
         # 任务被取消，这是正常的，静默处理
-        print(f"[信息] 监控任务已取消: user_id={user_id}, site_code={site_code}")
+        logger.info("[信息] 监控任务已取消: user_id=%s, site_code=%s", user_id, site_code)
         # 重新抛出异常，让调用者知道任务已取消
         raise
     except Exception as e:
         # 处理其他异常
-        print(f"[异常] 监控任务出错: {e}")
+        logger.exception("[异常] 监控任务出错: %s", e)
         raise HTTPException(status_code=500, detail=f"监控请求时出错: {e}")
     finally:
-        # 移除请求监听器，使用正确的 Playwright API
-        try:
-            # 在 Playwright 中，移除事件监听器的正确方式是使用 removeListener
-            page.remove_listener("request", handle_request)
-        except Exception as e:
-            # 忽略可能的错误，确保不影响主流程
-            print(f"[警告] 移除请求监听器失败：{e}")
+        supervisor.close_group(user_id, site_code, group)
+        await detach(page)
+
+    return buffer
+
+def build_domain_pattern(url: str, domains=None, api_paths=None) -> re.Pattern:
+    """
+    根据媒体url和domains生成URL正则，交给浏览器端做请求筛选。
+    指定 api_paths（路径前缀列表）时只匹配这些路径，否则排除静态资源，只拦截可能是接口的请求。
+    """
+    names = sorted({re.escape(d.strip(".")) for d in media_domains(url, domains) if d and d.strip(".")})
+    prefix = r"^https?://([^/?#]*\.)?(" + "|".join(names) + r")(:\d+)?"
+    paths = [p if p.startswith("/") else "/" + p for p in api_paths or [] if p]
+    if paths:
+        return re.compile(prefix + "(" + "|".join(re.escape(p) for p in paths) + ")", re.IGNORECASE)
+    return re.compile(prefix + "(?!" + STATIC_RESOURCE_SUFFIX + ")([/?#]|$)", re.IGNORECASE)
 
-    return requests 
+def create_capture_buffer() -> RequestRingBuffer:
+    """按 config.capture_capacity / config.capture_fields 创建监控请求缓冲区。"""
+    from server.app import get_config_item
+    config = get_config_item("config")
+    return RequestRingBuffer(
+        capacity=config.get("capture_capacity", 200),
+        fields=config.get("capture_fields", DEFAULT_CAPTURE_FIELDS),
+    )
 
-async def check_and_send_cookie(request, user_id, site_code, url):
-    """检查并发送cookie"""
+async def check_and_send_cookie(request, user_id, site_code, url, on_change: Callable[[], Any]=None, site_codes: set=None, matcher=None):
+    """
+    检查并发送cookie，只有媒体域名下的cookie发生变化（或超过max_age）时才投递；site_codes 为共用页面的全部站点。
+    matcher 为已编译的媒体域名匹配器，未传入时按媒体配置取用。
+    """
     from server.app import get_config_item
-    media_config = get_config_item("media", site_code)
-    if not media_config:
+    if matcher is None:
+        media_config = get_config_item("media", site_code)
+        if not media_config:
+            return
+        matcher = get_matcher(url, media_config.get("domains"))
+
+    # 只处理发往媒体域名的请求，其cookie即为该域名下的cookie
+    if not matcher.match_url(request.url):
+        metrics.requests_filtered.inc(user_id, site_code, "domain")
         return
         
     headers = await request.all_headers()
     cookie = headers.get("cookie")
     if not cookie:
+        metrics.requests_filtered.inc(user_id, site_code, "no_cookie")
         return
-        
-    # 提取域名信息
-    domain = [extract_main_domain(urlparse(url).netloc)]
-    if media_config.get("domains"):
-        domain.extend(media_config.get("domains"))
-    domain = list(set(domain))  # 去重
-    
-    host = extract_main_domain(headers.get(media_config.get("host")))
     
-    if host and domain and any(domain):
-        send_cookie(cookie, user_id, site_code)
-
-def send_cookie(cookie, user_id, site_code):
-    """向cookie API发送cookie"""
-    print("获取Cookie，发射Cookie")
-    from server.app import load_all_data
-    data = load_all_data()
-    config = data["config"]
+    config = get_config_item("config")
+    deliveries = []
+    # 每个站点各自去重；集合可能在运行中被修改，先复制
+    for code in tuple(site_codes) if site_codes else (site_code,):
+        task = cookie_cache.submit(
+            (user_id, code), cookie,
+            lambda c, code=code: send_cookie(c, user_id, code),
+            max_age=config.get("cookie_max_age", 600),
+        )
+        if task is not None:
+            deliveries.append(task)
+            capture_cookie_change(user_id, code, cookie, config)
+    if not deliveries:
+        metrics.requests_filtered.inc(user_id, site_code, "unchanged")
+        return
+    if on_change:
+        on_change()
+    # 在任务组的任务中等待投递完成：投递计入 task_concurrency，停止监控时随任务组取消；
+    # 某个站点停止时只取消它自己的投递，不影响其它站点
+    results = await asyncio.gather(*deliveries, return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+
+def capture_cookie_change(user_id, site_code, cookie, config):
+    """启用采集时记录一次 cookie 变化，默认只保留 cookie 名称。"""
+    sink = get_capture_sink()
+    if sink is None:
+        return
+    sink.write({"type": "cookie_change", "ts": time.time(), "user_id": user_id, "site_code": site_code,
+                "cookie": cookie if config.get("capture_cookie_values") else redact_cookie(cookie)})
+
+async def send_cookie(cookie, user_id, site_code):
+    """向cookie API发送cookie（异步投递，不阻塞事件循环）"""
+    logger.debug("获取Cookie，发射Cookie: user_id=%s, site_code=%s", user_id, site_code)
+    from server.app import get_config_item
+    config = get_config_item("config")
     
     # 类型转换
     try:
         user_id_int = int(user_id)
         site_code_int = int(site_code)
     except Exception as e:
-        print(f"[类型转换错误] user_id或site_code无法转换为int: {e}")
+        logger.error("[类型转换错误] user_id或site_code无法转换为int: %s", e)
         return
         
     # 获取配置
-    from server.app import get_config_item
     user_config = get_config_item("user", user_id_int)
     if not user_config:
-        print(f"[错误] 未找到user_id={user_id}的用户配置")
+        logger.error("[错误] 未找到user_id=%s的用户配置", user_id)
         return
         
     site_config = get_config_item("site", user_id_int, site_code_int)
     if not site_config:
-        print(f"[错误] 未找到site_code={site_code}的站点配置")
+        logger.error("[错误] 未找到site_code=%s的站点配置", site_code)
         return
         
-    # 发送cookie
-    url = f"{config['cookie_api']}?t={int(time.time() * 1000000000)}"
+    # 推送给实时事件订阅者
+    publish_cookie_change(user_id, site_code, cookie, site_config["account_type"])
+    
     json={"cookies": cookie, "account_type": site_config["account_type"], "code": site_code_int}
 
-    response = requests.post(url, json=json)
-    print(f"data: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())} url: {url}  json: {json} response: {response.status_code} {response.text}")
-    print("-" * 60)
-    return True
+    # 启用投递队列时先落盘，由队列批量投递
+    queue = get_delivery_queue()
+    if queue is not None:
+        await queue.enqueue(f"{user_id}:{site_code}", json)
+        return True
+
+    # 发送cookie
+    url = f"{config['cookie_api']}?t={int(time.time() * 1000000000)}"
+    response = await get_cookie_sender().post(url, json)
+    if response is None:
+        return False
+    # 载荷中的 cookie 值由日志格式化时脱敏
+    logger.debug("url: %s json: %s response: %s %s", url, json, response.status_code, response.text)
+    return response.ok
 
 def extract_main_domain(domain_str):
-    """提取主域名并加前缀点，如www.baidu.com -> .baidu.com"""
+    """提取主域名并加前缀点，如www.baidu.com -> .baidu.com，www.sina.com.cn -> .sina.com.cn"""
     if not domain_str:
         return ""
-    parts = domain_str.split(".")
-    if len(parts) >= 2:
-        return "." + ".".join(parts[-2:])
-    return "." + domain_str
\ No newline at end of file
+    return "." + registrable_domain(urlparse("//" + domain_str).hostname)
\ No newline at end of file
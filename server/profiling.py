@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+运行中诊断：限时采集事件循环线程的 CPU 剖析（pstats 格式）、tracemalloc 内存快照及其差异、
+按来源分组列出存活的 asyncio 任务及调用栈。任务来源取自创建时的任务名（"来源:标识"）
+"""
+
+import asyncio
+import cProfile
+import io
+import itertools
+import marshal
+import pickle
+import pstats
+import time
+import tracemalloc
+from collections import Counter, OrderedDict
+
+# 保留在内存中的 tracemalloc 快照数量
+MAX_SNAPSHOTS = 5
+# 快照中忽略的分配位置（tracemalloc 自身和导入机制）
+SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+# ------------------ CPU 剖析 ------------------
+
+_profiling = False
+
+async def profile_event_loop(seconds: float) -> cProfile.Profile:
+    """
+    在事件循环线程上开启 cProfile，持续 seconds 秒后停止。
+    期间该线程执行的全部回调和协程（监控、刷新、投递等）都会被采集；同一时间只允许一次。
+    """
+    global _profiling
+    if _profiling:
+        raise ProfilerBusy("已有CPU剖析正在进行")
+    _profiling = True
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profile.disable()
+    finally:
+        _profiling = False
+    profile.create_stats()
+    return profile
+
+
+def pstats_bytes(profile: cProfile.Profile) -> bytes:
+    """与 Profile.dump_stats 写出的文件相同，可用 pstats / snakeviz 打开。"""
+    return marshal.dumps(profile.stats)
+
+
+def pstats_text(profile: cProfile.Profile, sort: str = "cumulative", limit: int = 50) -> str:
+    stream = io.StringIO()
+    pstats.Stats(profile, stream=stream).sort_stats(sort).print_stats(limit)
+    return stream.getvalue()
+
+
+# ------------------ tracemalloc ------------------
+
+_snapshots = OrderedDict()  # id -> (采集时间, Snapshot)
+_snapshot_ids = itertools.count(1)
+
+
+def tracemalloc_status() -> dict:
+    current, peak = tracemalloc.get_traced_memory()
+    return {
+        "tracing": tracemalloc.is_tracing(),
+        "frames": tracemalloc.get_traceback_limit(),
+        "traced_bytes": current,
+        "peak_bytes": peak,
+        "snapshots": [{"id": sid, "taken_at": taken_at} for sid, (taken_at, _) in _snapshots.items()],
+    }
+
+
+def start_tracemalloc(frames: int = 10):
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+
+
+def stop_tracemalloc():
+    """停止追踪并丢弃已保存的快照。"""
+    tracemalloc.stop()
+    _snapshots.clear()
+
+
+def take_snapshot() -> int:
+    """采集一次快照（较慢，应在线程中调用），只保留最近 MAX_SNAPSHOTS 个，返回快照 id。"""
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("tracemalloc 未启动")
+    snapshot = tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+    snapshot_id = next(_snapshot_ids)
+    _snapshots[snapshot_id] = (time.time(), snapshot)
+    while len(_snapshots) > MAX_SNAPSHOTS:
+        _snapshots.popitem(last=False)
+    return snapshot_id
+
+
+def get_snapshot(snapshot_id: int):
+    entry = _snapshots.get(snapshot_id)
+    return entry[1] if entry else None
+
+
+def _stat_dict(stat) -> dict:
+    return {
+        "location": [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+        "size": stat.size,
+        "count": stat.count,
+    }
+
+
+def snapshot_top(snapshot_id: int, group_by: str = "lineno", limit: int = 20) -> list:
+    stats = get_snapshot(snapshot_id).statistics(group_by)
+    return [_stat_dict(stat) for stat in stats[:limit]]
+
+
+def snapshot_diff(base_id: int, target_id: int, group_by: str = "lineno", limit: int = 20) -> list:
+    """target 相对 base 的分配变化，按增长量从大到小排列。"""
+    diff = get_snapshot(target_id).compare_to(get_snapshot(base_id), group_by)
+    return [{**_stat_dict(stat), "size_diff": stat.size_diff, "count_diff": stat.count_diff} for stat in diff[:limit]]
+
+
+def snapshot_bytes(snapshot_id: int) -> bytes:
+    """与 Snapshot.dump 写出的文件相同，可用 tracemalloc.Snapshot.load 读回。"""
+    return pickle.dumps(get_snapshot(snapshot_id), pickle.HIGHEST_PROTOCOL)
+
+
+# ------------------ asyncio 任务 ------------------
+
+def task_origin(task: asyncio.Task) -> str:
+    """任务名 "monitor:1:2:..." 的来源为 monitor；未命名的任务（Task-N）归为 unnamed。"""
+    name = task.get_name()
+    if name.startswith("Task-") and name[5:].isdigit():
+        return "unnamed"
+    return name.split(":", 1)[0]
+
+
+def list_tasks(origin: str = None, stack_limit: int = 5) -> dict:
+    """列出当前事件循环中存活的任务，按来源统计数量；stack_limit 为每个任务保留的栈帧数（0 不取栈）。"""
+    tasks = []
+    by_origin = Counter()
+    for task in asyncio.all_tasks():
+        task_from = task_origin(task)
+        by_origin[task_from] += 1
+        if origin is not None and task_from != origin:
+            continue
+        coro = task.get_coro()
+        entry = {
+            "name": task.get_name(),
+            "origin": task_from,
+            "coro": getattr(coro, "__qualname__", repr(coro)),
+            "state": "done" if task.done() else "pending",
+        }
+        if stack_limit:
+            entry["stack"] = [
+                f"{frame.f_code.co_filename}:{frame.f_lineno} in {frame.f_code.co_name}"
+                for frame in task.get_stack(limit=stack_limit)
+            ]
+        tasks.append(entry)
+    tasks.sort(key=lambda entry: (entry["origin"], entry["name"]))
+    return {"total": sum(by_origin.values()), "by_origin": dict(by_origin.most_common()), "tasks": tasks}
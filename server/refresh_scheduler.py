@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+页面定时刷新调度：每个页面独立的刷新截止时间 + 随机抖动，限制同时刷新的页面数，配置修改无需重启即可生效
+"""
+
+import asyncio
+import logging
+import random
+import time
+from server import metrics
+
+logger = logging.getLogger(__name__)
+
+# 注入用户活动检测并返回闲置毫秒数，一次 evaluate 完成；尚未记录到活动时视为一直闲置
+ACTIVITY_SCRIPT = """
+() => {
+    if (!window._activityHooked) {
+        window._activityHooked = true;
+        window._lastUserActivity = window._lastUserActivity || 0;
+        const touch = () => { window._lastUserActivity = Date.now(); };
+        document.addEventListener('mousemove', touch);
+        document.addEventListener('keydown', touch);
+        document.addEventListener('click', touch);
+        document.addEventListener('scroll', touch);
+    }
+    return Date.now() - window._lastUserActivity;
+}
+"""
+
+
+class RefreshScheduler:
+    def __init__(self, app):
+        self.app = app
+        self.deadlines = {}  # task_key -> 下次刷新的 monotonic 时间
+        self.last_reloads = {}  # task_key -> 上次刷新的 monotonic 时间
+        self.expiries = {}  # task_key -> 媒体域名下最早过期的 cookie 的过期时间（unix 时间），expiry 策略使用
+        self.stats = {
+            "cycles": 0,
+            "last_cycle_seconds": 0.0,
+            "last_cycle_pages": 0,
+            "refreshed": 0,
+            "skipped": 0,  # 检测到用户活动而跳过
+            "deferred": 0,  # expiry 策略下会话未临近过期而推迟
+            "overdue": 0,  # 开始刷新时已超过截止时间 tick 以上
+            "failed": 0,
+        }
+
+    def _config(self) -> dict:
+        from server.app import get_config_item
+        return get_config_item("config")
+
+    def _interval(self, config: dict, task_key: str) -> float:
+        """优先使用媒体类型自己的 refresh_interval。"""
+        site_code = task_key.split(":", 2)[1]
+        media = config.get("media_codes", {}).get(site_code, {})
+        return media.get("refresh_interval", config.get("refresh_interval", 3000))
+
+    def _next_deadline(self, config: dict, task_key: str, now: float) -> float:
+        """
+        下次刷新时间为 now + interval + 抖动；expiry 策略下已知最早的 cookie 过期时间时，
+        取其与 过期时间 - cookie_expiry_margin 中较早的一个，保证在会话过期前检查到。
+        已经落在余量内的过期时间不参与计算，避免刷新后 cookie 未续期时每个 tick 都重复刷新。
+        """
+        interval = self._interval(config, task_key)
+        jitter = config.get("refresh_jitter", 0.1)
+        deadline = now + interval + random.uniform(0, interval * jitter)
+        expires = self.expiries.get(task_key)
+        if expires is not None and config.get("refresh_policy", "interval") == "expiry":
+            expiry_deadline = now + (expires - config.get("cookie_expiry_margin", 600) - time.time())
+            if expiry_deadline > now:
+                deadline = min(deadline, expiry_deadline)
+        return deadline
+
+    async def run(self):
+        """调度主循环，每个 tick 检查到期页面并发刷新。"""
+        while True:
+            try:
+                config = self._config()
+                tick = config.get("refresh_tick", 5)
+                await asyncio.sleep(tick)
+                await self.run_cycle(config, tick)
+            except asyncio.CancelledError:
+                logger.info("[定时刷新] 定时任务被取消")
+                break
+            except Exception as e:
+                logger.exception("[异常] 定时刷新任务异常: %s", e)
+                await asyncio.sleep(60)
+
+    async def run_cycle(self, config: dict, tick: float):
+        tasks = getattr(self.app.state, "monitor_tasks", {})
+        pages = getattr(self.app.state, "monitor_pages", {})
+        now = time.monotonic()
+
+        # 清理已结束的监控任务，给新页面分配首个截止时间
+        for task_key in list(pages):
+            task = tasks.get(task_key)
+            if not task or task.done():
+                pages.pop(task_key, None)
+        for task_key in list(self.deadlines):
+            if task_key not in pages:
+                del self.deadlines[task_key]
+                self.last_reloads.pop(task_key, None)
+                self.expiries.pop(task_key, None)
+        expiry_policy = config.get("refresh_policy", "interval") == "expiry"
+        for task_key in pages:
+            if task_key not in self.deadlines:
+                # expiry 策略下新页面本轮先读一次 cookie 过期时间，据此安排截止时间
+                self.deadlines[task_key] = now if expiry_policy else self._next_deadline(config, task_key, now)
+                self.last_reloads[task_key] = now
+
+        due = [task_key for task_key, deadline in self.deadlines.items() if deadline <= now]
+        if not due:
+            return
+
+        semaphore = asyncio.Semaphore(config.get("refresh_concurrency", 4))
+        started = time.monotonic()
+        await asyncio.gather(*(self._refresh_one(config, semaphore, task_key, self._resolve_page(task_key, pages), tick) for task_key in due))
+        elapsed = time.monotonic() - started
+        metrics.refresh_cycle_seconds.observe(elapsed)
+        self.stats["cycles"] += 1
+        self.stats["last_cycle_seconds"] = round(elapsed, 3)
+        self.stats["last_cycle_pages"] = len(due)
+        logger.info("[定时刷新] 本轮处理 %s 个页面，耗时 %.1f秒", len(due), elapsed)
+
+    def _resolve_page(self, task_key: str, pages: dict):
+        """页面可能已被回收重建，优先取 BrowserManager 中当前登记的页面。"""
+        user_id, site_code, _ = task_key.split(":", 2)
+        browser_manager = getattr(self.app.state, "browser_manager", None)
+        page = browser_manager.current_page(user_id, site_code) if browser_manager else None
+        return page or pages.get(task_key)
+
+    async def _refresh_one(self, config: dict, semaphore: asyncio.Semaphore, task_key: str, page, tick: float):
+        async with semaphore:
+            start = time.monotonic()
+            if start - self.deadlines.get(task_key, start) > tick:
+                self.stats["overdue"] += 1
+            self.deadlines[task_key] = self._next_deadline(config, task_key, start)
+            if page is None or page.is_closed():
+                return
+            # 用户活动检测时间阈值（秒），默认60秒内有活动则认为用户正在操作
+            user_activity_threshold = config.get("user_activity_threshold", 60)
+            timeout = config.get("refresh_timeout", 30) * 1000
+            expiry_policy = config.get("refresh_policy", "interval") == "expiry"
+            try:
+                if expiry_policy and not await self._should_reload(config, task_key, page, start):
+                    self.stats["deferred"] += 1
+                    self.deadlines[task_key] = self._next_deadline(config, task_key, time.monotonic())
+                    return
+                try:
+                    idle_time = await page.evaluate(ACTIVITY_SCRIPT) / 1000  # 转为秒
+                    if idle_time < user_activity_threshold:
+                        logger.info("[定时刷新] 检测到用户活动，跳过刷新: %s, 闲置时间: %.1f秒", task_key, idle_time)
+                        self.stats["skipped"] += 1
+                        return
+                except Exception as activity_error:
+                    # 检测失败则默认刷新
+                    logger.warning("[警告] 检测用户活动失败: %s, 错误: %s", task_key, activity_error)
+                with metrics.page_operation_seconds.time("reload"):
+                    await page.reload(timeout=timeout)
+                self.last_reloads[task_key] = time.monotonic()
+                self.stats["refreshed"] += 1
+                if expiry_policy:
+                    # 刷新后 cookie 通常已续期，重新读取过期时间再安排下次检查
+                    try:
+                        self.expiries[task_key] = await self._earliest_expiry(config, task_key, page)
+                    except Exception as e:
+                        logger.warning("[警告] 读取Cookie过期时间失败: %s, 错误: %s", task_key, e)
+                        self.expiries.pop(task_key, None)
+                    self.deadlines[task_key] = self._next_deadline(config, task_key, time.monotonic())
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.warning("[异常] 刷新页面失败: %s, 错误: %s", task_key, e)
+
+    async def _earliest_expiry(self, config: dict, task_key: str, page):
+        """媒体域名下最早过期的 cookie 的过期时间（unix 时间），都是会话 cookie 时返回 None。"""
+        site_code = task_key.split(":", 2)[1]
+        media = config.get("media_codes", {}).get(site_code, {})
+        urls = [media.get("url", task_key.split(":", 2)[2])]
+        urls.extend(f"https://{domain.lstrip('.')}/" for domain in media.get("domains", []))
+        cookies = await page.context.cookies(urls)
+        # 会话 cookie 的 expires 为 -1，不参与判断
+        expires = [cookie["expires"] for cookie in cookies if cookie.get("expires", -1) > 0]
+        return min(expires) if expires else None
+
+    async def _should_reload(self, config: dict, task_key: str, page, now: float) -> bool:
+        """expiry 策略：媒体域名下的 cookie 即将过期，或距上次刷新超过兜底间隔时才刷新。"""
+        fallback = config.get("refresh_fallback_interval", 21600)
+        if now - self.last_reloads.get(task_key, now) >= fallback:
+            return True
+        try:
+            expires = await self._earliest_expiry(config, task_key, page)
+        except Exception as e:
+            logger.warning("[警告] 读取Cookie过期时间失败: %s, 错误: %s", task_key, e)
+            self.expiries.pop(task_key, None)
+            return True
+        self.expiries[task_key] = expires
+        if expires is None:
+            return False
+        margin = config.get("cookie_expiry_margin", 600)
+        return expires - time.time() <= margin
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+启动过程计时：浏览器在后台启动，HTTP 接口先就绪；记录从服务启动到各阶段的耗时，
+供 /api/ready 和 /metrics 查询
+"""
+
+import time
+
+from server import metrics
+
+# 记录的阶段：api_ready 接口可用，browser_ready 浏览器启动完成，
+# first_request 收到第一个HTTP请求，first_monitor 第一个监控页面打开并开始监听
+PHASES = ("api_ready", "browser_ready", "first_request", "first_monitor")
+
+
+class StartupTracker:
+    def __init__(self):
+        self.started_at = time.monotonic()  # 随 server.app 一同导入，近似为进程启动时间
+        self.browser = "starting"  # starting / ready / failed
+        self.error = None
+        self.phases = {}  # 阶段 -> 距启动的秒数
+
+    def mark(self, phase: str):
+        """记录阶段首次发生的时间，之后重复调用不覆盖。"""
+        if phase not in self.phases:
+            self.phases[phase] = round(time.monotonic() - self.started_at, 3)
+
+    def browser_ready(self):
+        self.browser = "ready"
+        self.error = None
+        self.mark("browser_ready")
+
+    def browser_failed(self, error: Exception):
+        self.browser = "failed"
+        self.error = str(error)
+
+    @property
+    def ready(self) -> bool:
+        return self.browser == "ready"
+
+    def snapshot(self) -> dict:
+        return {
+            "ready": self.ready,
+            "browser": self.browser,
+            "error": self.error,
+            "uptime_seconds": round(time.monotonic() - self.started_at, 3),
+            **{f"time_to_{phase}": self.phases.get(phase) for phase in PHASES},
+        }
+
+
+class FirstRequestTimer:
+    """ASGI 中间件：只在收到第一个HTTP请求时记录一次，之后直接透传。"""
+
+    def __init__(self, app, tracker: StartupTracker):
+        self.app = app
+        self.tracker = tracker
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and "first_request" not in self.tracker.phases:
+            self.tracker.mark("first_request")
+        await self.app(scope, receive, send)
+
+
+startup = StartupTracker()
+
+metrics.registry.gauge(
+    "startup_phase_seconds", "Seconds from process start to each startup phase",
+    lambda: {(phase,): seconds for phase, seconds in startup.phases.items()}, ("phase",))
+metrics.registry.gauge("browser_ready", "1 once the browser has launched", lambda: 1 if startup.ready else 0)
@@ -1,22 +1,46 @@
 // 全局配置对象
 var config = {};
-// 全局分页变量
-let allSitesData = [];
+// 全局分页和筛选变量，筛选和分页都由服务端完成
 let currentPage = 1;
 let pageSize = 10;
+let currentFilter = {};
+// 监控状态，key 为 `${user_id}:${site_code}`
+let monitorStates = {};
+const MONITOR_STATE_TEXT = { running: '监控中', degraded: '异常恢复中', stopped: '已停止' };
 
 /**
- * 请求获取所有用户数据
- * @returns {Promise<Array>} 用户数据数组
+ * 分页请求站点账号
+ * @param {number} page 页码
+ * @param {number} size 每页条数
+ * @param {Object} filter 筛选条件
+ * @returns {Promise<Object>} { total, items }
  */
-function fetchUsers() {
+function fetchAccounts(page, size, filter) {
+  const params = { page: page, page_size: size };
+  Object.entries(filter || {}).forEach(([key, value]) => {
+    // 多选值以逗号分隔传给服务端
+    const text = Array.isArray(value) ? value.join(',') : value;
+    if (text) params[key] = text;
+  });
   return $.ajax({
-    url: '/api/users',
+    url: '/api/accounts',
     method: 'GET',
+    data: params,
     dataType: 'json'
   }).catch(function(err) {
-    console.error('获取用户数据失败:', err);
-    return [];
+    console.error('获取账号数据失败:', err);
+    return { total: 0, items: [] };
+  });
+}
+
+/**
+ * 按当前筛选条件加载并渲染指定页
+ * @param {number} page 页码
+ */
+function loadPage(page) {
+  currentPage = page;
+  return fetchAccounts(page, pageSize, currentFilter).then(function(res) {
+    renderPagedTable(res, currentPage, pageSize);
   });
 }
 
@@ -46,39 +70,23 @@ function fetchMediaCodes() {
 
 /**
  * 渲染分页表格
- * @param {Array} data 全部数据
+ * @param {Object} data 服务端返回的当前页 { total, items }
  * @param {number} page 当前页码
  * @param {number} size 每页条数
  */
 function renderPagedTable(data, page, size) {
   const $tbody = $('#sites-table-tbody');
   $tbody.empty();
-  if (!Array.isArray(data) || data.length === 0) {
-    $tbody.append('<tr><td colspan="9" style="text-align:center;">暂无数据</td></tr>');
-    updatePagination(0, page, size);
-    return;
-  }
-  // 扁平化所有站点
-  let flatList = [];
-  data.forEach(user => {
-    if (user.sites && Array.isArray(user.sites)) {
-      user.sites.forEach(site => {
-        flatList.push({ user, site });
-      });
-    }
-  });
-  const total = flatList.length;
-  const start = (page - 1) * size;
-  const end = start + size;
-  const pageList = flatList.slice(start, end);
+  const total = (data && data.total) || 0;
+  const pageList = (data && data.items) || [];
   if (pageList.length === 0) {
     $tbody.append('<tr><td colspan="9" style="text-align:center;">暂无数据</td></tr>');
     updatePagination(total, page, size);
     return;
   }
-  pageList.forEach(({ user, site }) => {
-    const $tr = $('<tr></tr>');
-    $tr.append(`<td>${user.user_id !== undefined ? user.user_id : ''}</td>`);
+  pageList.forEach(site => {
+    const $tr = $('<tr></tr>').attr('data-monitor-key', `${site.user_id}:${site.code}`).attr('data-account-id', site.id);
+    $tr.append(`<td>${site.user_id !== undefined ? site.user_id : ''}</td>`);
     const mediaType = config.media_codes && config.media_codes[site.code];
     $tr.append(`<td>${mediaType !== undefined ? mediaType.name : ''}</td>`);
     // 账号类型
@@ -93,7 +101,7 @@ function renderPagedTable(data, page, size) {
     // 描述
     $tr.append(`<td>${site.description !== undefined ? site.description : ''}</td>`);
     // 状态
-    $tr.append('<td>--</td>');
+    $tr.append(`<td class="monitor-state">${monitorStateText(`${site.user_id}:${site.code}`)}</td>`);
     // 操作
     $tr.append('<td>--</td>');
     $tbody.append($tr);
@@ -101,6 +109,51 @@ function renderPagedTable(data, page, size) {
   updatePagination(total, page, size);
 }
 
+/**
+ * 监控状态显示文本
+ * @param {string} key `${user_id}:${site_code}`
+ * @returns {string}
+ */
+function monitorStateText(key) {
+  const state = monitorStates[key];
+  return state ? (MONITOR_STATE_TEXT[state] || state) : '--';
+}
+
+/**
+ * 加载所有监控任务的当前状态
+ * @returns {Promise}
+ */
+function fetchMonitorStates() {
+  return $.ajax({
+    url: '/api/monitor/bulk/status',
+    method: 'POST',
+    contentType: 'application/json',
+    data: '{}',
+    dataType: 'json'
+  }).then(function(res) {
+    (res.results || []).forEach(function(item) {
+      const [userId, siteCode] = item.task_key.split(':');
+      monitorStates[`${userId}:${siteCode}`] = item.state;
+    });
+  }).catch(function(err) {
+    console.error('获取监控状态失败:', err);
+  });
+}
+
+/**
+ * 订阅监控状态实时事件，更新表格中的状态列
+ */
+function subscribeMonitorEvents() {
+  if (!window.EventSource) return;
+  const source = new EventSource('/api/events?types=monitor_state');
+  source.addEventListener('monitor_state', function(e) {
+    const event = JSON.parse(e.data);
+    const key = `${event.user_id}:${event.site_code}`;
+    monitorStates[key] = event.state;
+    $(`#sites-table-tbody tr[data-monitor-key="${key}"] td.monitor-state`).text(monitorStateText(key));
+  });
+}
+
 /**
  * 渲染分页控件
  * @param {number} total 总条数
@@ -115,21 +168,24 @@ function updatePagination(total, page, size) {
   html += `<button type="button" ${page === 1 ? 'disabled' : ''} class="page-btn" data-page="${page - 1}">上一页</button>`;
   html += `<span> 第${page}/${totalPages}页 </span>`;
   html += `<button type="button" ${page === totalPages ? 'disabled' : ''} class="page-btn" data-page="${page + 1}">下一页</button>`;
-  html += `<select id="page-size-select" style="margin-left:8px;">` +
-    [10, 20, 50].map(sz => `<option value="${sz}" ${sz === size ? 'selected' : ''}>每页${sz}条</option>`).join('') +
-    `</select>`;
   $pagination.html(html);
+  $('#page-size-select').val(String(size));
 }
 
 // 分页按钮事件
 $(document).on('click', '.page-btn', function () {
   const page = parseInt($(this).data('page'));
   if (!isNaN(page)) {
-    currentPage = page;
-    renderPagedTable(allSitesData, currentPage, pageSize);
+    loadPage(page);
   }
 });
 
+// 每页条数切换
+$(document).on('change', '#page-size-select', function () {
+  pageSize = parseInt($(this).val()) || 10;
+  loadPage(1);
+});
+
 /**
  * 渲染媒体类型和账号类型下拉框
  * @param {Object} mediaCodes 媒体类型配置对象
@@ -166,18 +222,17 @@ function initPage() {
     renderMediaCodes(config);
 
     // 其它初始化任务
-    fetchUsers().then(function(users) {
-      allSitesData = users || [];
-      currentPage = 1;
-      renderPagedTable(allSitesData, currentPage, pageSize);
+    fetchMonitorStates().then(function() {
+      loadPage(1);
     });
+    subscribeMonitorEvents();
   });
 }
 
 // 页面加载后初始化
 $(document).ready(initPage);
 
-// 纯前端筛选功能
+// 筛选条件，交给服务端筛选
 function getFilterValues() {
   // 获取筛选表单的所有值
   const form = document.getElementById('filter-form');
@@ -186,46 +241,23 @@ function getFilterValues() {
     account: formData.get('account')?.trim(),
     contact: formData.get('contact')?.trim(),
     description: formData.get('description')?.trim(),
-    media_type: formData.getAll('media_type'), // 多选
+    code: formData.getAll('media_type'), // 多选
     account_type: formData.getAll('account_type') // 多选
   };
 }
 
-function filterSitesData() {
-  const filter = getFilterValues();
-  // 过滤allSitesData，返回新数组
-  return allSitesData.map(user => {
-    // 过滤站点
-    const filteredSites = (user.sites || []).filter(site => {
-      // 账号/手机号
-      if (filter.account && !site.account.includes(filter.account)) return false;
-      // 负责人
-      if (filter.contact && !site.contact.includes(filter.contact)) return false;
-      // 描述
-      if (filter.description && !site.description.includes(filter.description)) return false;
-      // 媒体类型
-      if (filter.media_type.length > 0 && !filter.media_type.includes(String(site.code))) return false;
-      // 账号类型（如有）
-      if (filter.account_type.length > 0 && !filter.account_type.includes(String(site.account_type))) return false;
-      return true;
-    });
-    return { ...user, sites: filteredSites };
-  });
-}
-
 // 监听筛选表单提交事件
 $(document).on('submit', '#filter-form', function(e) {
   e.preventDefault();
-  currentPage = 1;
-  const filtered = filterSitesData();
-  renderPagedTable(filtered, currentPage, pageSize);
+  currentFilter = getFilterValues();
+  loadPage(1);
 });
 
 // 监听重置按钮
 $(document).on('reset', '#filter-form', function(e) {
   setTimeout(() => {
-    currentPage = 1;
-    renderPagedTable(allSitesData, currentPage, pageSize);
+    currentFilter = {};
+    loadPage(1);
   }, 0);
 });
 
@@ -296,22 +328,27 @@ $(document).on('click', '.btn-save-row', function () {
     alert('用户ID、媒体类型、账号类型、账号为必填项');
     return;
   }
-  // 查找或创建用户
-  let user = allSitesData.find(u => String(u.user_id) === String(user_id));
-  if (!user) {
-    user = { user_id: Number(user_id), sites: [] };
-    allSitesData.push(user);
-  }
-  // 添加新站点
-  user.sites.push({
-    code: Number(code),
-    account_type: Number(account_type),
-    account,
-    password,
-    contact,
-    description
+  // 保存到服务端
+  $.ajax({
+    url: '/api/accounts',
+    method: 'POST',
+    contentType: 'application/json',
+    data: JSON.stringify({
+      user_id: Number(user_id),
+      code: Number(code),
+      account_type: Number(account_type),
+      account,
+      password,
+      contact,
+      description
+    }),
+    dataType: 'json'
+  }).then(function() {
+    // 移除编辑行并刷新表格
+    $tr.remove();
+    loadPage(1);
+  }).catch(function(err) {
+    console.error('保存账号失败:', err);
+    alert('保存失败：' + ((err.responseJSON && JSON.stringify(err.responseJSON.detail)) || err.statusText));
   });
-  // 移除编辑行并刷新表格
-  $tr.remove();
-  renderPagedTable(allSitesData, 1, pageSize);
 });
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+监控请求派生任务的准入控制：每个监控一个任务组，待执行任务放在有界队列中，
+所有任务组共享一个全局并发上限；队列满时按策略处理：
+- drop_oldest：丢弃最早的待执行任务
+- merge：同 key 的待执行任务只保留最新一个，新 key 仍放不下时丢弃最早的
+- backpressure：可等待的调用方（route 模式）等到有空位再放行，不能等待的调用方直接拒绝新任务
+任务组关闭时取消全部待执行和执行中的任务，任务异常统一记录日志
+"""
+
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Hashable
+
+from server import metrics
+
+logger = logging.getLogger(__name__)
+
+OVERLOAD_POLICIES = ("drop_oldest", "merge", "backpressure")
+
+tasks_shed = metrics.registry.counter(
+    "monitor_tasks_shed_total", "Monitor tasks dropped, merged or rejected by admission control", ("user_id", "site_code", "reason"))
+task_failures = metrics.registry.counter(
+    "monitor_task_failures_total", "Monitor tasks that raised an exception", ("user_id", "site_code"))
+
+
+class TaskGroup:
+    def __init__(self, user_id: str, site_code: str, budget: asyncio.Semaphore, max_pending: int = 100, policy: str = "merge"):
+        if policy not in OVERLOAD_POLICIES:
+            raise ValueError(f"不支持的过载策略: {policy}")
+        self.user_id = user_id
+        self.site_code = site_code
+        self.budget = budget  # 全局并发上限，所有任务组共享
+        self.max_pending = max_pending
+        self.policy = policy
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "dropped": 0, "merged": 0, "rejected": 0}
+        self.pending = OrderedDict()  # key -> 创建协程的函数，按到达顺序
+        self.running = set()  # 持有执行中任务的引用，避免被回收
+        self._wakeup = asyncio.Event()
+        self._room = asyncio.Event()
+        self._room.set()
+        self._closed = False
+        self._dispatcher = asyncio.create_task(self._dispatch(), name=f"task-group:{user_id}:{site_code}")
+
+    def _shed(self, reason: str):
+        self.stats[reason] += 1
+        tasks_shed.inc(self.user_id, self.site_code, reason)
+
+    def submit(self, factory: Callable[[], Awaitable], key: Hashable = None) -> bool:
+        """
+        提交一个任务，factory 在真正执行时才创建协程，被丢弃的任务不会留下未等待的协程。
+        key 只在 merge 策略下用于合并；返回是否已放入队列。
+        """
+        if self._closed:
+            return False
+        self.stats["submitted"] += 1
+        if self.policy == "merge" and key is not None and key in self.pending:
+            del self.pending[key]
+            self._shed("merged")
+        elif len(self.pending) >= self.max_pending:
+            if self.policy == "backpressure":
+                self._shed("rejected")
+                return False
+            self.pending.popitem(last=False)
+            self._shed("dropped")
+        if key is None or self.policy != "merge":
+            key = object()  # 不参与合并的任务用唯一 key，不会与调用方的 key 冲突
+        self.pending[key] = factory
+        if len(self.pending) >= self.max_pending:
+            self._room.clear()
+        self._wakeup.set()
+        return True
+
+    async def submit_wait(self, factory: Callable[[], Awaitable], key: Hashable = None) -> bool:
+        """backpressure 策略下等到队列有空位再提交，其他策略与 submit 相同。"""
+        if self.policy == "backpressure":
+            while not self._closed and len(self.pending) >= self.max_pending:
+                await self._room.wait()
+        return self.submit(factory, key)
+
+    async def _dispatch(self):
+        while True:
+            if not self.pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            await self.budget.acquire()
+            if not self.pending:
+                self.budget.release()
+                continue
+            _, factory = self.pending.popitem(last=False)
+            self._room.set()
+            try:
+                task = asyncio.create_task(factory(), name=f"monitor-check:{self.user_id}:{self.site_code}")
+            except Exception:
+                self.budget.release()
+                raise
+            self.running.add(task)
+            task.add_done_callback(self._on_done)
+
+    def _on_done(self, task: asyncio.Task):
+        self.running.discard(task)
+        self.budget.release()
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is None:
+            self.stats["completed"] += 1
+            return
+        self.stats["failed"] += 1
+        task_failures.inc(self.user_id, self.site_code)
+        logger.error("[异常] 监控任务执行失败: user_id=%s, site_code=%s, 错误: %r",
+                     self.user_id, self.site_code, error, exc_info=error)
+
+    def close(self):
+        """取消待执行和执行中的全部任务。"""
+        self._closed = True
+        self._dispatcher.cancel()
+        self.pending.clear()
+        self._room.set()
+        for task in list(self.running):
+            task.cancel()
+
+    def snapshot(self) -> dict:
+        return {"user_id": self.user_id, "site_code": self.site_code, "policy": self.policy,
+                "pending": len(self.pending), "running": len(self.running), **self.stats}
+
+
+class TaskSupervisor:
+    """全部任务组的登记处，持有全局并发上限。"""
+
+    def __init__(self):
+        self.groups = {}  # (user_id, site_code) -> TaskGroup
+        self._budget = None
+        self._limit = None
+
+    def _get_budget(self, limit: int) -> asyncio.Semaphore:
+        if self._budget is None:
+            self._budget = asyncio.Semaphore(limit)
+            self._limit = limit
+        return self._budget
+
+    def open_group(self, user_id: str, site_code: str, config: dict) -> TaskGroup:
+        """为监控创建任务组；同一监控已有任务组时先关闭旧的。"""
+        self.close_group(user_id, site_code)
+        group = TaskGroup(
+            user_id, site_code, self._get_budget(config.get("task_concurrency", 64)),
+            max_pending=config.get("task_queue_size", 100),
+            policy=config.get("task_overload_policy", "merge"),
+        )
+        self.groups[(user_id, site_code)] = group
+        return group
+
+    def close_group(self, user_id: str, site_code: str, group: TaskGroup = None):
+        """关闭任务组；传入 group 时只在它仍是当前任务组时才移除登记。"""
+        current = self.groups.get((user_id, site_code))
+        target = group or current
+        if target is None:
+            return
+        target.close()
+        if current is target:
+            del self.groups[(user_id, site_code)]
+
+    def stats(self) -> dict:
+        groups = [group.snapshot() for group in self.groups.values()]
+        return {
+            "concurrency": self._limit,
+            "running": sum(group["running"] for group in groups),
+            "pending": sum(group["pending"] for group in groups),
+            "groups": groups,
+        }
+
+
+supervisor = TaskSupervisor()
+
+metrics.registry.gauge(
+    "monitor_task_queue_depth", "Pending monitor tasks waiting for the concurrency budget",
+    lambda: {(g.user_id, g.site_code): len(g.pending) for g in supervisor.groups.values()}, ("user_id", "site_code"))
+metrics.registry.gauge(
+    "monitor_tasks_running", "Monitor tasks currently running",
+    lambda: sum(len(g.running) for g in supervisor.groups.values()))
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+浏览器崩溃监控：订阅浏览器断开、页面崩溃和页面关闭事件，把受影响的监控标记为 degraded，
+按退避策略重建浏览器 / 页面，监控任务会自动把监听器挂到新页面上
+"""
+
+import asyncio
+import logging
+import time
+from server.event_bus import publish_monitor_state
+
+logger = logging.getLogger(__name__)
+
+
+class BrowserWatchdog:
+    def __init__(self, app):
+        self.app = app
+        self.health = {}  # task_key -> {"state": "degraded", "reason": ..., "since": ...}，正常运行的不登记
+        self._recovering = {}  # 恢复目标(manager 或 (manager, page_key)) -> Task
+        self._last_ok = time.monotonic()
+        self.stats = {
+            "browser_disconnects": 0,
+            "page_crashes": 0,
+            "page_closes": 0,
+            "recoveries": 0,
+            "recovery_failures": 0,
+            "last_detect_seconds": None,  # 从上次确认健康到发现异常的时间（轮询发现时有意义）
+            "last_recovery_seconds": None,  # 从发现异常到恢复完成的时间
+            "max_recovery_seconds": None,
+        }
+
+    def install(self, browser_manager):
+        browser_manager.add_hooks(on_browser=self._watch_browser, on_page=self._watch_page)
+
+    def _config(self) -> dict:
+        from server.app import get_config_item
+        return get_config_item("config")
+
+    def _monitor_keys(self, manager, page_keys=None) -> list:
+        """找出受影响的监控任务 task_key；page_keys 为空时返回该 manager 负责的全部监控。"""
+        browser_manager = self.app.state.browser_manager
+        result = []
+        for task_key in self.app.state.monitor_tasks:
+            user_id, site_code, _ = task_key.split(":", 2)
+            if page_keys is not None:
+                if (user_id, site_code) in page_keys:
+                    result.append(task_key)
+            elif not hasattr(browser_manager, "shard_for") or browser_manager.shard_for(user_id) is manager:
+                result.append(task_key)
+        return result
+
+    def _group_keys(self, task_keys) -> list:
+        """展开为共用这些页面的全部站点 task_key，用于推送状态事件。"""
+        groups = getattr(self.app.state, "monitor_groups", {})
+        result = []
+        for task_key in task_keys:
+            user_id, _, url = task_key.split(":", 2)
+            result.extend(f"{user_id}:{code}:{url}" for code in groups.get(task_key) or [task_key.split(":", 2)[1]])
+        return result
+
+    def _mark_degraded(self, task_keys, reason: str):
+        now = time.time()
+        for task_key in task_keys:
+            self.health.setdefault(task_key, {"state": "degraded", "reason": reason, "since": now})
+        if task_keys:
+            logger.warning("[崩溃监控] %s，受影响的监控: %s", reason, task_keys)
+        for task_key in self._group_keys(task_keys):
+            publish_monitor_state(task_key, "degraded", reason)
+
+    def _mark_recovered(self, task_keys, detected_at: float):
+        elapsed = round(time.monotonic() - detected_at, 3)
+        for task_key in task_keys:
+            self.health.pop(task_key, None)
+        self.stats["recoveries"] += 1
+        self.stats["last_recovery_seconds"] = elapsed
+        self.stats["max_recovery_seconds"] = max(elapsed, self.stats["max_recovery_seconds"] or 0)
+        logger.info("[崩溃监控] 已恢复 %s 个监控，耗时 %s秒", len(task_keys), elapsed)
+        for task_key in self._group_keys(task_keys):
+            publish_monitor_state(task_key, "running", "recovered")
+
+    def _spawn(self, target, coro):
+        if target in self._recovering:
+            coro.close()
+            return
+        # 任务名带上恢复对象：浏览器或页面 key
+        label = "page:" + ":".join(map(str, target[1])) if isinstance(target, tuple) else "browser"
+        task = asyncio.create_task(coro, name=f"watchdog-recover:{label}")
+        self._recovering[target] = task
+        task.add_done_callback(lambda _: self._recovering.pop(target, None))
+
+    # ------------------ 事件订阅 ------------------
+
+    def _watch_browser(self, manager, browser):
+        browser.on("disconnected", lambda _: self._on_browser_lost(manager, browser, time.monotonic()))
+
+    def _watch_page(self, manager, page_key, page):
+        page.on("crash", lambda _: self._on_page_lost(manager, page_key, page, "crash", time.monotonic()))
+        page.on("close", lambda _: self._on_page_lost(manager, page_key, page, "close", time.monotonic()))
+
+    def _on_browser_lost(self, manager, browser, detected_at: float):
+        if manager.closing or manager.browser is not browser:
+            return
+        self.stats["browser_disconnects"] += 1
+        self._mark_degraded(self._monitor_keys(manager), "浏览器断开")
+        self._spawn(manager, self._recover_browser(manager, detected_at))
+
+    def _on_page_lost(self, manager, page_key, page, reason: str, detected_at: float):
+        # 主动关闭或已被替换的页面，不需要恢复
+        if manager.closing or manager.pages.get(page_key) is not page:
+            return
+        task_keys = self._monitor_keys(manager, {page_key})
+        if not task_keys:
+            return
+        self.stats["page_crashes" if reason == "crash" else "page_closes"] += 1
+        self._mark_degraded(task_keys, f"页面{'崩溃' if reason == 'crash' else '被关闭'}")
+        self._spawn((manager, page_key), self._recover_page(manager, page_key, page, detected_at))
+
+    # ------------------ 恢复 ------------------
+
+    async def _with_backoff(self, action, description: str) -> bool:
+        config = self._config()
+        delay = config.get("watchdog_backoff", 1)
+        max_delay = config.get("watchdog_max_backoff", 60)
+        for attempt in range(config.get("watchdog_max_attempts", 8)):
+            try:
+                await action()
+                return True
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("[崩溃监控] %s失败(第%s次)，%s秒后重试: %s", description, attempt + 1, delay, e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, max_delay)
+        self.stats["recovery_failures"] += 1
+        logger.error("[崩溃监控] %s多次失败，已放弃", description)
+        return False
+
+    async def _reopen_pages(self, manager, task_keys):
+        async def reopen(task_key):
+            user_id, site_code, url = task_key.split(":", 2)
+            await manager.get_page(user_id, site_code, url)
+        await asyncio.gather(*(reopen(task_key) for task_key in task_keys))
+
+    async def _recover_browser(self, manager, detected_at: float):
+        async def restart():
+            await manager.restart_browser()
+            await self._reopen_pages(manager, self._monitor_keys(manager))
+        if await self._with_backoff(restart, "重建浏览器"):
+            self._mark_recovered(self._monitor_keys(manager), detected_at)
+
+    async def _recover_page(self, manager, page_key, page, detected_at: float):
+        async def recycle():
+            # 只移除出问题的页面；监控任务可能已先一步打开了新页面
+            task_keys = self._monitor_keys(manager, {page_key})
+            if manager.pages.get(page_key) is page:
+                del manager.pages[page_key]
+                if not page.is_closed():
+                    await page.close()
+            # 按监控任务的 url 重新打开
+            if task_keys:
+                await self._reopen_pages(manager, task_keys[:1])
+        if await self._with_backoff(recycle, f"重建页面{page_key}"):
+            self._mark_recovered(self._monitor_keys(manager, {page_key}), detected_at)
+
+    # ------------------ 轮询兜底 ------------------
+
+    async def run(self):
+        """定期检查事件可能漏掉的情况：浏览器未连接、监控页面已关闭。"""
+        while True:
+            try:
+                await asyncio.sleep(self._config().get("watchdog_interval", 10))
+                self.check()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.exception("[异常] 崩溃监控检查异常: %s", e)
+
+    def check(self):
+        now = time.monotonic()
+        browser_manager = self.app.state.browser_manager
+        managers = getattr(browser_manager, "shards", [browser_manager])
+        healthy = True
+        for manager in managers:
+            if manager in self._recovering or manager.closing:
+                continue
+            if manager.browser is not None and not manager.browser.is_connected():
+                healthy = False
+                self.stats["last_detect_seconds"] = round(now - self._last_ok, 3)
+                self._on_browser_lost(manager, manager.browser, now)
+                continue
+            for task_key in self._monitor_keys(manager):
+                user_id, site_code, _ = task_key.split(":", 2)
+                page = manager.pages.get((user_id, site_code))
+                if page is not None and page.is_closed():
+                    healthy = False
+                    self.stats["last_detect_seconds"] = round(now - self._last_ok, 3)
+                    self._on_page_lost(manager, (user_id, site_code), page, "close", now)
+        if healthy:
+            self._last_ok = now
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from server.logger import redact
+
+
+def test_redacts_cookie_header_values():
+    assert redact("Cookie: sid=abc; token=xyz") == "Cookie: sid=***; token=***"
+    assert redact("headers set-cookie: sid=abc") == "headers set-cookie: sid=***"
+
+
+def test_redacts_quoted_cookie_values():
+    assert redact('{"cookie": "sid=abc; token=xyz"}') == '{"cookie": "sid=***; token=***"}'
+    assert redact("{'cookies': 'sid=abc'}") == "{'cookies': 'sid=***'}"
+
+
+def test_keeps_cookie_words_in_plain_messages():
+    # server/monitor_task.py send_cookie 的调试日志
+    message = "获取Cookie，发射Cookie: user_id=1, site_code=2"
+    assert redact(message) == message